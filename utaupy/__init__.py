@@ -1,11 +1,16 @@
 from utaupy import (  # noqa: F401
     backup,
     convert,
+    corpus,
+    dataset,
+    frq,
     hts,
     label,
     otoini,
+    pitch,
     reaper,
     reclist,
+    render,
     setparam,
     shiro,
     svp,
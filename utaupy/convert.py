@@ -8,9 +8,14 @@ UTAU関連ファイルの相互変換
 
 # from . import reaper as _reaper
 # from . import reclist as _reclist
-# from . import table as _table
+from itertools import groupby
+from operator import attrgetter
+from os import makedirs
+from os.path import commonpath, dirname, join, normpath, relpath, splitext
+
 from utaupy import label as _label
 from utaupy import otoini as _otoini
+from utaupy import table as _table
 from utaupy import ust as _ust
 
 
@@ -117,21 +122,18 @@ def ust2otoini_mono(ust, name_wav, d_table, dt=100, debug=False):
         t += length  # 今のノート終了位置が次のノート開始位置
 
     # Otoを音素ごとに分割
+    # テーブルに無い歌詞は、テーブルの見出しと最長一致する部分ずつ変換する
+    converter = _table.as_converter(d_table)
     mono_otoini = _otoini.OtoIni()  # mono_otoを入れるリスト
     for simple_oto in kana_otoini:
         if debug:
             print(f'    {simple_oto.values}')
-        try:
-            phonemes = d_table[simple_oto.alias]
-        except KeyError as e:
-            print('KeyError in utaupy.convert.ust2otoini_mono---------')
-            print(
-                'ひらがなローマ字変換に失敗しました。半角スペースで音素分割してぶち込みます。'
-            )
-            print('エラー詳細:', e)
-            print('--------------------------------------\n')
-            phonemes = simple_oto.alias.split()
-            print(phonemes)
+        phonemes = converter.convert(simple_oto.alias)
+        # 4音素以上には未対応。特殊音素と判断して1音素として処理
+        if len(phonemes) > 3:
+            print(f'\n[WARN] when setting alias : phonemes = {phonemes}-------------')
+            print('1エイリアスあたり 1, 2, 3 音素しか対応していません。')
+            phonemes = [''.join(phonemes)]
         # 子音+母音 「か(k a)」
         if len(phonemes) == 2:
             # 子音部分
@@ -219,16 +221,14 @@ def ust2otoini_romaji_cv(ust, name_wav, d_table, dt=100, replace=True, debug=Fal
 
     otoini = _otoini.OtoIni()
     t = 0  # ノート開始時刻を記録
+    # テーブルに無い歌詞は、テーブルの見出しと最長一致する部分ずつ変換する
+    converter = _table.as_converter(d_table)
 
     # NOTE: ここnotes[2:-1]とust.values[2:-1]で処理時間に差は出る？
     for note in ust.notes:
         if debug:
             print(f'    {ust}')
-        try:
-            phonemes = d_table[note.lyric]
-        except KeyError as e:
-            print(f'    [WARN] KeyError in utaupy.convert.ust2otoini_romaji_cv : {e}')
-            phonemes = note.lyric.split()
+        phonemes = converter.convert(note.lyric)
 
         length = note.length_ms
         oto = _otoini.Oto()
@@ -273,67 +273,100 @@ def ust2otoini_romaji_cv(ust, name_wav, d_table, dt=100, replace=True, debug=Fal
     return otoini
 
 
-def otoini2label(otoini, mode='auto', debug=False):
+def iter_otoini2phonemes(otos, mode='auto', debug=False):
     """
-    OtoIniクラスオブジェクトからLabelクラスオブジェクトを生成
-    発声開始: オーバーラップ
-    発声終了: 次のノートのオーバーラップ
+    Oto を1つずつ受け取り、Phonemeを1つずつ返すジェネレータ。
+    otoini2label() と同じ変換を、入力を書き換えずに一定のメモリで行う。
+    発声開始: 先行発声
+    発声終了: 次のOtoの先行発声 (最後のOtoだけ右ブランク)
     発音記号: エイリアス流用
-    otoini_time_order: otoiniの時間単位の桁。
-    label_time_order : ラベルの時間単位の桁。
     """
+    allowed_modes = ('auto', 'mono', 'romaji_cv')
+    if mode not in allowed_modes:
+        raise ValueError(f'argument "mode" must be in {allowed_modes}')
     # ms(10^-4) -> 100ns(10^-7) の換算
     time_order_ratio = 10000
-    # time_order_ratio = otoini_time_order / label_time_order
-    # print('  time_order_ratio:', time_order_ratio)
 
     # wavファイルが余計にあるときに追加される行を無視する
-    otoini.data = [oto for oto in otoini if oto.alias != '']
-
-    allowed_modes = ('auto', 'mono', 'romaji_cv')
-    if mode not in allowed_modes:
-        raise ValueError(f'argument "mode" must be in {allowed_modes}')
-    # エイリアスのタイプ自動判別
-    if mode == 'auto':
-        if otoini.is_mono():
-            mode = 'mono'
-        else:
-            mode = 'romaji_cv'
-    if mode == 'romaji_cv':
-        # print('  mode: OtoIni(romaji_cv) -> Label(mono)')
-        # モノフォン化
-        otoini = otoini.monophonize()
-    # elif mode == 'mono':
-    #     print('  mode: OtoIni(mono) -> Label(mono)')
-
-    # 計算の重複を避けるために [[発音開始時刻, 発音記号], ...] の仮リストにする
-    tmp = []
-    for oto in otoini:
+    otos = (oto for oto in otos if oto.alias != '')
+    # 空白を含まないエイリアスはモノフォン化しても変わらないので、
+    # 'auto' は常にモノフォン化するのと同じ結果になる。
+    if mode in ('auto', 'romaji_cv'):
+        otos = _otoini.iter_monophones(otos)
+
+    previous_oto = None
+    previous_start = None
+    for oto in otos:
         if debug:
             print(str(oto))
         t_start = int(time_order_ratio * (oto.offset + oto.preutterance))
-        tmp.append([t_start, oto.alias])
-
-    # OtoオブジェクトをPhonemeオブジェクトに変換する
-    label = _label.Label()
-    for i, v in enumerate(tmp[:-1]):
-        phoneme = _label.Phoneme()
-        phoneme.start = v[0]
-        phoneme.end = tmp[i + 1][0]
-        phoneme.symbol = v[1]
-        label.append(phoneme)
+        if previous_oto is not None:
+            yield _label.Phoneme(previous_start, t_start, previous_oto.alias)
+        previous_oto = oto
+        previous_start = t_start
 
     # 最終Otoだけ終了位置が必要なので 特別な処理
-    oto = otoini[-1]
-    phoneme = _label.Phoneme()
-    phoneme.start = int(time_order_ratio * (oto.offset + oto.preutterance))
-    phoneme.end = int(time_order_ratio * oto.cutoff2)  # 発声終了位置は右ブランク
-    phoneme.symbol = tmp[-1][1]
-    label.append(phoneme)
+    if previous_oto is not None:
+        yield _label.Phoneme(
+            previous_start,
+            int(time_order_ratio * previous_oto.cutoff2),  # 発声終了位置は右ブランク
+            previous_oto.alias,
+        )
+
 
+def otoini2label(otoini, mode='auto', debug=False):
+    """
+    OtoIniクラスオブジェクトからLabelクラスオブジェクトを生成
+    発声開始: オーバーラップ
+    発声終了: 次のノートのオーバーラップ
+    発音記号: エイリアス流用
+    otoini_time_order: otoiniの時間単位の桁。
+    label_time_order : ラベルの時間単位の桁。
+    """
+    label = _label.Label()
+    label.data = list(iter_otoini2phonemes(otoini, mode=mode, debug=debug))
     return label
 
 
+def otoini2lab_files(otos, out_dir, mode='auto', encoding='utf-8') -> list:
+    """
+    Otoを1つずつ読みながら、WAVファイルごとのLABファイルを out_dir に書き出す。
+    同じWAVファイルのエントリは連続していることを前提とする。
+    返り値は出力したLABファイルのパスのリスト。
+
+    otos: Otoのイテラブル、または {oto.iniのパス: Otoのイテラブル} の辞書
+          (UtauVoiceBank.otoinis など)。辞書のときは、音階ごとのフォルダにある
+          同じ名前のWAVファイルを区別するため、oto.ini のフォルダの相対パスを保って出力する。
+    """
+    if isinstance(otos, dict):
+        otoini_dirs = [dirname(path_otoini) for path_otoini in otos]
+        root = commonpath(otoini_dirs) if otoini_dirs else ''
+        groups = [(relpath(d, root), group) for d, group in zip(otoini_dirs, otos.values())]
+    else:
+        groups = [('', otos)]
+    paths = []
+    written = set()
+    for sub_dir, group in groups:
+        for name_wav, otos_wav in groupby(group, key=attrgetter('filename')):
+            # oto.ini のファイル名はサブフォルダを \ で区切ることがある
+            name_lab = f'{splitext(name_wav.replace(chr(92), "/"))[0]}.lab'
+            path_lab = normpath(join(out_dir, sub_dir, name_lab))
+            # 離れた位置に同じWAVファイルのエントリがあると、先に書いたLABファイルを壊してしまう
+            if path_lab in written:
+                raise ValueError(
+                    f'Entries for the same WAV file must be consecutive.: {name_wav} ({path_lab})'
+                )
+            written.add(path_lab)
+            makedirs(dirname(path_lab), exist_ok=True)
+            with open(path_lab, mode='w', encoding=encoding, newline='\n') as f:
+                separator = ''
+                for phoneme in iter_otoini2phonemes(otos_wav, mode=mode):
+                    f.write(f'{separator}{phoneme.start} {phoneme.end} {phoneme.symbol}')
+                    separator = '\n'
+            paths.append(path_lab)
+    return paths
+
+
 def label2otoini(label, name_wav):
     """
     LabelオブジェクトをOtoIniオブジェクトに変換
@@ -0,0 +1,242 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+大量のLABファイルを1つのファイルにまとめて扱うモジュールです。
+
+ファイル形式 (リトルエンディアン)
+    ヘッダ       : b'UTAUPYLC', バージョン(uint32), 予約(uint32),
+                   音素数N(uint64), 発話数U(uint64), メタ情報のバイト数(uint64)
+    開始時刻     : int64 x N
+    終了時刻     : int64 x N
+    発話の区切り : int64 x (U + 1)
+    音素記号番号 : int32 x N (8バイト境界まで0埋め)
+    メタ情報     : {"symbols": [音素記号, ...], "names": [発話名, ...]} のJSON(UTF-8)
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+from glob import glob
+from itertools import repeat
+from operator import floordiv, sub
+from os.path import basename, join, splitext
+
+from utaupy import label as _label
+
+MAGIC = b'UTAUPYLC'
+VERSION = 1
+HEADER_FORMAT = '<8sIIQQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def main():
+    """
+    直接実行されたときの挙動
+    """
+    print('フォルダ内のLABファイルを1つのファイルにまとめます。')
+    lab_dir = input('lab_dir: ').strip('"')
+    path_out = input('path_out: ').strip('"')
+    corpus = LabelCorpus.build(lab_dir, path_out)
+    print(f'{len(corpus)} 発話, {corpus.num_phonemes} 音素')
+
+
+def _as_view(buffer, typecode, start, count):
+    """
+    バッファの一部を、コピーせずに数値の配列として扱えるようにする。
+    ビッグエンディアンの環境ではバイト順を入れ替えるためコピーする。
+    """
+    itemsize = array(typecode).itemsize
+    view = memoryview(buffer)[start : start + itemsize * count]
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    a = array(typecode, view)
+    a.byteswap()
+    return memoryview(a)
+
+
+class LabelCorpus:
+    """
+    複数のモノラベルを、開始時刻・終了時刻・音素記号番号の配列として持つクラス。
+    各発話の Label は必要になったときに生成する。
+    """
+
+    def __init__(self, starts, ends, codes, offsets, symbols: list, names: list):
+        self.starts = starts  # 開始時刻 (100ns)
+        self.ends = ends  # 終了時刻 (100ns)
+        self.codes = codes  # 音素記号番号
+        self.offsets = offsets  # 発話ごとの先頭の音素の位置
+        self.symbols = symbols  # 音素記号番号 → 音素記号
+        self.names = names  # 発話名 (拡張子なしのファイル名)
+        self._name_to_index = {name: i for i, name in enumerate(names)}
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key) -> _label.Label:
+        """
+        発話番号または発話名を指定して、その発話の Label を返す。
+        """
+        index = self._name_to_index[key] if isinstance(key, str) else key
+        i, j = self.offsets[index], self.offsets[index + 1]
+        symbols = self.symbols
+        new_label = _label.Label()
+        new_label.data = list(
+            map(
+                _label.Phoneme,
+                self.starts[i:j].tolist(),
+                self.ends[i:j].tolist(),
+                [symbols[code] for code in self.codes[i:j]],
+            )
+        )
+        return new_label
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def num_phonemes(self) -> int:
+        """
+        コーパス全体の音素数
+        """
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, lab_dir, path_out=None, time_unit='100ns'):
+        """
+        フォルダ内のLABファイルをまとめて LabelCorpus を生成する。
+        path_out を指定したときはファイルにも出力する。
+        """
+        starts = array('q')
+        ends = array('q')
+        codes = array('i')
+        offsets = array('q', [0])
+        symbol_to_code = {}
+        names = []
+        for path_lab in sorted(glob(join(str(lab_dir).strip('"'), '*.lab'))):
+            l_start, l_end, l_symbol = _label._load_columns(  # noqa: SLF001
+                path_lab, time_unit=time_unit
+            )
+            starts.extend(l_start)
+            ends.extend(l_end)
+            codes.extend(
+                symbol_to_code.setdefault(symbol, len(symbol_to_code)) for symbol in l_symbol
+            )
+            offsets.append(len(codes))
+            names.append(splitext(basename(path_lab))[0])
+        corpus = cls(
+            memoryview(starts),
+            memoryview(ends),
+            memoryview(codes),
+            memoryview(offsets),
+            list(symbol_to_code),
+            names,
+        )
+        if path_out is not None:
+            corpus.write(path_out)
+        return corpus
+
+    @classmethod
+    def open(cls, path):
+        """
+        ファイルをメモリマップして LabelCorpus を生成する。
+        配列はファイルの内容をコピーせずに参照する。
+        """
+        with open(str(path).strip('"'), 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, num_phonemes, num_utterances, meta_size = struct.unpack_from(
+            HEADER_FORMAT, mm
+        )
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            raise ValueError(f'Unsupported label corpus file: {path}')
+        position = HEADER_SIZE
+        starts = _as_view(mm, 'q', position, num_phonemes)
+        position += 8 * num_phonemes
+        ends = _as_view(mm, 'q', position, num_phonemes)
+        position += 8 * num_phonemes
+        offsets = _as_view(mm, 'q', position, num_utterances + 1)
+        position += 8 * (num_utterances + 1)
+        codes = _as_view(mm, 'i', position, num_phonemes)
+        position += 4 * num_phonemes + (-4 * num_phonemes) % 8
+        meta = json.loads(mm[position : position + meta_size].decode('utf-8'))
+        corpus = cls(starts, ends, codes, offsets, meta['symbols'], meta['names'])
+        corpus._mmap = mm  # noqa: SLF001
+        return corpus
+
+    def close(self):
+        """
+        メモリマップしたファイルを閉じる。
+        """
+        if self._mmap is None:
+            return
+        for view in (self.starts, self.ends, self.codes, self.offsets):
+            view.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def write(self, path):
+        """
+        ファイル出力
+        """
+        meta = json.dumps(
+            {'symbols': self.symbols, 'names': self.names}, ensure_ascii=False
+        ).encode('utf-8')
+        header = struct.pack(
+            HEADER_FORMAT, MAGIC, VERSION, 0, self.num_phonemes, len(self), len(meta)
+        )
+        with open(path, 'wb') as f:
+            f.write(header)
+            for view, typecode in (
+                (self.starts, 'q'),
+                (self.ends, 'q'),
+                (self.offsets, 'q'),
+                (self.codes, 'i'),
+            ):
+                a = array(typecode, view)
+                if sys.byteorder != 'little':
+                    a.byteswap()
+                a.tofile(f)
+            f.write(bytes((-4 * self.num_phonemes) % 8))
+            f.write(meta)
+
+    def durations(self) -> list:
+        """
+        全音素の発声時間 (100ns) のリスト
+        """
+        return list(map(sub, self.ends, self.starts))
+
+    def count_symbols(self) -> dict:
+        """
+        音素記号ごとの出現回数
+        """
+        symbols = self.symbols
+        return {symbols[code]: n for code, n in Counter(self.codes).items()}
+
+    def duration_histogram(self, bin_size: int = 100000) -> dict:
+        """
+        音素記号ごとの発声時間のヒストグラム
+        {音素記号: {区間の開始時刻(100ns): 回数}} の辞書を返す。
+
+        bin_size: 区間の幅 (100ns)。省略時は10ms。
+        """
+        bins = map(floordiv, map(sub, self.ends, self.starts), repeat(bin_size))
+        histogram = {}
+        symbols = self.symbols
+        for (code, i_bin), n in sorted(Counter(zip(self.codes, bins)).items()):
+            histogram.setdefault(symbols[code], {})[i_bin * bin_size] = n
+        return histogram
+
+
+if __name__ == '__main__':
+    main()
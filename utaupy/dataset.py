@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+歌唱データベースから学習用データセットを作るためのモジュールです。
+"""
+
+import logging
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from os import makedirs
+from os.path import basename, isfile, join, splitext
+
+from utaupy import label as _label
+
+
+def main():
+    """
+    直接実行されたときの挙動
+    """
+    print('WAVファイルとLABファイルをフレーズ単位に切り分けます。')
+    wav_dir = input('wav_dir: ').strip('"')
+    lab_dir = input('lab_dir: ').strip('"')
+    out_dir = input('out_dir: ').strip('"')
+    slice_corpus(wav_dir, lab_dir, out_dir)
+
+
+def slice_wav_and_label(
+    path_wav, path_lab, out_dir, symbols=('pau', 'sil'), max_len=None, time_unit='100ns'
+) -> list:
+    """
+    1組のWAVファイルとLABファイルを、ラベルの休符の位置でフレーズ単位に切り分けて保存する。
+    WAVファイルは切り出す範囲だけをシークして読み取る。
+    切り分けたLABファイルの時刻は、切り出したWAVファイルの先頭を0とする。
+
+    返り値は [(WAVファイルのパス, LABファイルのパス), ...] のリスト。
+    """
+    stem = splitext(basename(path_wav))[0]
+    segments = _label.load(path_lab, time_unit=time_unit).segment_by(symbols, max_len=max_len)
+    result = []
+    with wave.open(str(path_wav), 'rb') as wav_in:
+        params = wav_in.getparams()
+        framerate = wav_in.getframerate()
+        for i, segment in enumerate(segments):
+            if len(segment) == 0:
+                continue
+            t_start = segment[0].start
+            # 100ns単位の時刻をフレーム位置に変換する
+            first_frame = min(round(t_start * framerate / 10000000), params.nframes)
+            last_frame = min(round(segment[-1].end * framerate / 10000000), params.nframes)
+            wav_in.setpos(first_frame)
+            frames = wav_in.readframes(last_frame - first_frame)
+            # WAVファイルを出力
+            path_wav_out = join(out_dir, f'{stem}_{i:03d}.wav')
+            with wave.open(path_wav_out, 'wb') as wav_out:
+                wav_out.setparams(params)
+                wav_out.writeframes(frames)
+            # WAVファイルの先頭が0になるようにずらしてLABファイルを出力
+            path_lab_out = join(out_dir, f'{stem}_{i:03d}.lab')
+            segment.shift(-t_start)
+            segment.write(path_lab_out, time_unit=time_unit)
+            result.append((path_wav_out, path_lab_out))
+    return result
+
+
+def slice_corpus(
+    wav_dir,
+    lab_dir,
+    out_dir,
+    symbols=('pau', 'sil'),
+    max_len=None,
+    time_unit='100ns',
+    max_workers=None,
+) -> list:
+    """
+    フォルダ内のWAVファイルとLABファイルの組を、フレーズ単位に切り分けて保存する。
+    ファイルごとの処理は複数プロセスで並列に行う。
+
+    symbols : 区切りに使う休符の音素記号
+    max_len : フレーズの最大の長さ(100ns)。utaupy.label.Label.segment_by() を参照。
+
+    返り値は [(WAVファイルのパス, LABファイルのパス), ...] のリスト。
+    """
+    makedirs(out_dir, exist_ok=True)
+    pairs = []
+    for path_wav in sorted(glob(join(str(wav_dir).strip('"'), '*.wav'))):
+        path_lab = join(str(lab_dir).strip('"'), f'{splitext(basename(path_wav))[0]}.lab')
+        if isfile(path_lab):
+            pairs.append((path_wav, path_lab))
+        else:
+            logging.warning('WAVファイルに対応するLABファイルがありません : %s', path_lab)
+
+    result = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                slice_wav_and_label, path_wav, path_lab, out_dir, symbols, max_len, time_unit
+            )
+            for path_wav, path_lab in pairs
+        ]
+        for future in futures:
+            result += future.result()
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+UTAU音源の周波数表ファイル (*_wav.frq) を扱うモジュールです。
+
+ファイル形式 (リトルエンディアン)
+    ヘッダ : b'FREQ0003', フレームあたりのサンプル数(int32), 平均周波数(float64),
+             予約(16バイト), フレーム数N(int32)
+    データ : (周波数(float64), 振幅(float64)) x N
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'FREQ0003'
+HEADER_FORMAT = '<8sid16xi'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def main():
+    """
+    直接実行されたときの挙動
+    """
+    print('周波数表ファイルの情報を表示します。')
+    path = input('path_frq: ').strip('"')
+    with load(path) as frq:
+        print(f'samples_per_frame: {frq.samples_per_frame}')
+        print(f'average_f0       : {frq.average_f0}')
+        print(f'frames           : {len(frq)}')
+
+
+def load(path):
+    """
+    周波数表ファイルを読み取って Frq オブジェクトを返す。
+    ファイルはメモリマップし、周波数と振幅はファイルの内容をコピーせずに参照する。
+    """
+    with open(str(path).strip('"'), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, samples_per_frame, average_f0, num_frames = struct.unpack_from(HEADER_FORMAT, mm)
+    if magic != MAGIC or len(mm) < HEADER_SIZE + 16 * num_frames:
+        mm.close()
+        raise ValueError(f'Unsupported frq file: {path}')
+    view = memoryview(mm)[HEADER_SIZE : HEADER_SIZE + 16 * num_frames]
+    if sys.byteorder == 'little':
+        values = view.cast('d')
+    else:
+        # ビッグエンディアンの環境ではバイト順を入れ替えるためコピーする
+        a = array('d', view)
+        a.byteswap()
+        view.release()
+        values = memoryview(a)
+    frq = Frq(values[0::2], values[1::2], samples_per_frame, average_f0)
+    frq._values = values  # noqa: SLF001
+    frq._mmap = mm  # noqa: SLF001
+    return frq
+
+
+class Frq:
+    """
+    周波数表ファイルの中身を扱うクラス。
+    f0 と amp はフレームごとの周波数(Hz)と振幅の配列。
+    """
+
+    def __init__(self, f0, amp, samples_per_frame: int = 256, average_f0: float = None):
+        if len(f0) != len(amp):
+            raise ValueError('f0 and amp must have the same length.')
+        self.f0 = f0
+        self.amp = amp
+        self.samples_per_frame = samples_per_frame
+        # 平均周波数の指定がなければ、有声フレームの周波数の平均にする
+        if average_f0 is None:
+            voiced = [x for x in f0 if x > 0]
+            average_f0 = sum(voiced) / len(voiced) if voiced else 0.0
+        self.average_f0 = average_f0
+        self._values = None
+        self._mmap = None
+        self.closed = False
+
+    def __len__(self):
+        return len(self.f0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        メモリマップしたファイルを閉じる。
+        """
+        self.closed = True
+        if self._mmap is None:
+            return
+        for view in (self.f0, self.amp, self._values):
+            view.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def write(self, path):
+        """
+        ファイル出力
+        """
+        values = array('d', bytes(16 * len(self)))
+        values[0::2] = array('d', self.f0)
+        values[1::2] = array('d', self.amp)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        with open(path, 'wb') as f:
+            f.write(
+                struct.pack(
+                    HEADER_FORMAT, MAGIC, self.samples_per_frame, self.average_f0, len(self)
+                )
+            )
+            values.tofile(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,8 @@ import re
 from collections import UserList
 from copy import copy, deepcopy
 from decimal import ROUND_HALF_UP, Decimal
-from itertools import chain
+from functools import lru_cache
+from itertools import chain, repeat
 from typing import Union
 
 from . import label as _label  # pylint: disable=relative-beyond-top-level
@@ -23,6 +24,28 @@ VOWELS = ['a', 'i', 'u', 'e', 'o', 'A', 'I', 'U', 'E', 'O', 'N', 'ae', 'AE']
 BREAKS = ['br', 'cl']
 PAUSES = ['pau']
 SILENCES = ['sil']
+# 休符として扱う p1
+REST_CLASSES = frozenset(('s', 'p'))
+
+# フルコンテキストラベルの各項の書式
+# pylint: disable=line-too-long
+FORMAT_P = '{}@{}^{}-{}+{}={}_{}%{}^{}_{}~{}-{}!{}[{}${}]{}'
+FORMAT_A = '/A:{}-{}-{}@{}~{}'
+FORMAT_B = '/B:{}_{}_{}@{}|{}'
+FORMAT_C = '/C:{}+{}+{}@{}&{}'
+FORMAT_D = '/D:{}!{}#{}${}%{}|{}&{};{}-{}'
+FORMAT_E = '/E:{}]{}^{}={}~{}!{}@{}#{}+{}]{}${}|{}[{}&{}]{}={}^{}~{}#{}_{};{}${}&{}%{}[{}|{}]{}-{}^{}+{}~{}={}@{}${}!{}%{}#{}|{}|{}-{}&{}&{}+{}[{};{}]{};{}~{}~{}^{}^{}@{}[{}#{}={}!{}~{}+{}!{}^{}'  # noqa: E501
+FORMAT_F = '/F:{}#{}#{}-{}${}${}+{}%{};{}'
+FORMAT_G = '/G:{}_{}'
+FORMAT_H = '/H:{}_{}'
+FORMAT_I = '/I:{}_{}'
+FORMAT_J = '/J:{}~{}@{}'
+# pylint: enable=line-too-long
+
+# フルコンテキストラベルの項を区切る文字列と、項内の値を区切る文字
+RE_CONTEXT_GROUP = re.compile('/.:')
+CONTEXT_SEPARATORS = '=+-~∼!@#$%^ˆ&;_|[]'
+_CONTEXT_SEPARATOR_TABLE = str.maketrans(dict.fromkeys(CONTEXT_SEPARATORS, '\x1f'))
 
 # e1を埋めるのに使う
 NOTENUM_TO_ABSPITCH_DICT = {
@@ -275,6 +298,46 @@ def load(source):
     return full_label.load(source)
 
 
+def split_contexts(str_contexts: str) -> list:
+    """
+    時刻を除いたフルコンテキストラベルの1行を、
+    [p, a, b, c, d, e, f, g, h, i, j] の二次元リストにする。
+    """
+    # 区切り文字を1種類にそろえてから分割する
+    return [
+        s.translate(_CONTEXT_SEPARATOR_TABLE).split('\x1f')
+        for s in RE_CONTEXT_GROUP.split(str_contexts)
+    ]
+
+
+def iter_contexts(source, encoding='utf-8'):
+    """
+    フルコンテキストラベルを1行ずつ読み取って、
+    (開始時刻, 終了時刻, [p, a, b, c, d, e, f, g, h, i, j]) を返すジェネレータ。
+    OneLine や Song をつくらないので、長いファイルを順に処理するときに使う。
+    空白行は無視する。
+
+    source: path, lines
+    """
+    if isinstance(source, list):
+        yield from _iter_contexts_from_lines(source)
+        return
+    # パスに半角スペースが入っている場合に出現する引用符を除去
+    with open(str(source).strip('"'), encoding=encoding) as f:
+        yield from _iter_contexts_from_lines(f)
+
+
+def _iter_contexts_from_lines(lines):
+    """
+    行のイテラブルを解析して、(開始時刻, 終了時刻, コンテキストの二次元リスト) を返す。
+    """
+    for line in lines:
+        line_split = line.split(maxsplit=2)
+        if not line_split:
+            continue
+        yield int(line_split[0]), int(line_split[1]), split_contexts(line_split[2].rstrip())
+
+
 def notenum_to_abspitch(notenum) -> str:
     """
     音高をC4のような記法に変換する
@@ -377,17 +440,12 @@ class HTSFullLabel(UserList):
         for line in lines:
             # 1行分の情報用のオブジェクトを生成
             ol = OneLine()
-            # 正規表現で上手く区切れない文字を置換する
             # 空白で分割して、時刻情報とそれ以外のコンテキストに分ける
             line_split = line.split(maxsplit=2)
             ol.start = int(line_split[0])
             ol.end = int(line_split[1])
-            str_contexts = line_split[2]
-            # コンテキスト文字列を /A: などの文字列で区切って一次元リストにする
-            l_contexts = re.split('/.:', str_contexts)
-            # 特定の文字でさらに区切って二次元リストにする
-            sep = re.escape('=+-~∼!@#$%^ˆ&;_|[]')
-            l_contexts_2d = [re.split((f'[{sep}]'), s) for s in l_contexts]
+            # コンテキスト文字列を /A: などの文字列と区切り文字で分けて二次元リストにする
+            l_contexts_2d = split_contexts(line_split[2])
             # 1行分の情報用のオブジェクトに、各種コンテキストを登録する
             ol.p, ol.a, ol.b, ol.c, ol.d, ol.e, ol.f, ol.g, ol.h, ol.i, ol.j = l_contexts_2d
             # 1行分の情報用のオブジェクトを HTSFullLabel オブジェクトに追加する。
@@ -516,28 +574,26 @@ class OneLine:
         self.song = Song()
 
     def __str__(self):
-        # pylint: disable=consider-using-f-string, line-too-long
+        # pylint: disable=consider-using-f-string
         str_self = ''.join(
             (
                 f'{self.start} {self.end} ',
                 # Phoneme 関連
-                '{}@{}^{}-{}+{}={}_{}%{}^{}_{}~{}-{}!{}[{}${}]{}'.format(*self.p),
+                FORMAT_P.format(*self.p),
                 # Syllable 関連
-                '/A:{}-{}-{}@{}~{}'.format(*self.a),
-                '/B:{}_{}_{}@{}|{}'.format(*self.b),
-                '/C:{}+{}+{}@{}&{}'.format(*self.c),
+                FORMAT_A.format(*self.a),
+                FORMAT_B.format(*self.b),
+                FORMAT_C.format(*self.c),
                 # Note 関連
-                '/D:{}!{}#{}${}%{}|{}&{};{}-{}'.format(*self.d),
-                '/E:{}]{}^{}={}~{}!{}@{}#{}+{}]{}${}|{}[{}&{}]{}={}^{}~{}#{}_{};{}${}&{}%{}[{}|{}]{}-{}^{}+{}~{}={}@{}${}!{}%{}#{}|{}|{}-{}&{}&{}+{}[{};{}]{};{}~{}~{}^{}^{}@{}[{}#{}={}!{}~{}+{}!{}^{}'.format(
-                    *self.e
-                ),
-                '/F:{}#{}#{}-{}${}${}+{}%{};{}'.format(*self.f),
+                FORMAT_D.format(*self.d),
+                FORMAT_E.format(*self.e),
+                FORMAT_F.format(*self.f),
                 # Phrase 関連
-                '/G:{}_{}'.format(*self.g),
-                '/H:{}_{}'.format(*self.h),
-                '/I:{}_{}'.format(*self.i),
+                FORMAT_G.format(*self.g),
+                FORMAT_H.format(*self.h),
+                FORMAT_I.format(*self.i),
                 # Song 関連
-                '/J:{}~{}@{}'.format(*self.j),
+                FORMAT_J.format(*self.j),
             )
         )
         return str_self  # noqa: RET504
@@ -861,39 +917,23 @@ class Song(UserList):
         self._fill_note_contexts()
         self._fill_song_contexts()
 
-    def _fill_phoneme_contexts(self, hts_conf: Union[None, dict]):
+    def _fill_phoneme_contexts(self, hts_conf):
         """
         p1, p12, p13, p14, p15 を補完する。
+        hts_conf には音素分類用の辞書のほか、
+        utaupy.table.CompiledTable や PhonemeClassifier も指定できる。
         """
+        self._fill_p1(PhonemeClassifier.from_conf(hts_conf))
         # p12, p13, p14, p15を埋める
-        if hts_conf is None:
-            self._fill_p1(vowels=VOWELS, pauses=PAUSES, silences=SILENCES, breaks=BREAKS)
-        else:
-            self._fill_p1(
-                vowels=hts_conf['VOWELS'],
-                pauses=hts_conf['PAUSES'],
-                silences=hts_conf['SILENCES'],
-                breaks=hts_conf['BREAKS'],
-            )
         self._fill_p12_p13()
         self._fill_p14_p15()
 
-    def _fill_p1(self, vowels, pauses, silences, breaks):
+    def _fill_p1(self, classifier: 'PhonemeClassifier'):
         # p1 を埋める
-        for phoneme in self.all_phonemes:
-            phoneme_identity = phoneme.identity
-            if phoneme_identity == 'xx':
-                phoneme.language_independent_identity = 'xx'
-            elif phoneme_identity in vowels:
-                phoneme.language_independent_identity = 'v'
-            elif phoneme_identity in pauses:
-                phoneme.language_independent_identity = 'p'
-            elif phoneme_identity in silences:
-                phoneme.language_independent_identity = 's'
-            elif phoneme_identity in breaks:
-                phoneme.language_independent_identity = 'b'
-            else:
-                phoneme.language_independent_identity = 'c'
+        phonemes = self.all_phonemes
+        classes = classifier.classify_many([phoneme.identity for phoneme in phonemes])
+        for phoneme, p1 in zip(phonemes, classes):
+            phoneme.language_independent_identity = p1
 
     def _fill_p12_p13(self):
         """
@@ -1632,23 +1672,31 @@ class Phoneme:
         """
         return self.end - self.start
 
-    def is_vowel(self):
+    def _p1(self, classifier):
+        """
+        classifier があればそれで音素記号を分類し、なければ p1 の値を返す。
+        """
+        if classifier is None:
+            return self.language_independent_identity
+        return classifier.classify(self.identity)
+
+    def is_vowel(self, classifier: 'PhonemeClassifier' = None):
         """
         母音かどうか
         """
-        return self.language_independent_identity == 'v'
+        return self._p1(classifier) == 'v'
 
-    def is_consonant(self):
+    def is_consonant(self, classifier: 'PhonemeClassifier' = None):
         """
         子音かどうか
         """
-        return self.language_independent_identity == 'c'
+        return self._p1(classifier) == 'c'
 
-    def is_rest(self):
+    def is_rest(self, classifier: 'PhonemeClassifier' = None):
         """
         休符かどうか
         """
-        return self.language_independent_identity in ('s', 'p')
+        return self._p1(classifier) in REST_CLASSES
 
     def is_pau(self):
         """休符かどうかを判定
@@ -1658,11 +1706,96 @@ class Phoneme:
         """
         return self.is_rest()
 
-    def is_break(self):
+    def is_break(self, classifier: 'PhonemeClassifier' = None):
         """
         息継ぎかどうか
         """
-        return self.language_independent_identity == 'b'
+        return self._p1(classifier) == 'b'
+
+
+class PhonemeClassifier:
+    """
+    音素記号から p1 (v, c, p, s, b, xx) を求めるクラス。
+    音素分類ごとに1回だけ {音素記号: p1} の辞書を作り、分類は辞書の参照のみで行う。
+    複数の分類に含まれる音素記号は、母音, 休符(pau), 無音(sil), 息継ぎ の順に優先する。
+    """
+
+    def __init__(self, vowels=VOWELS, pauses=PAUSES, silences=SILENCES, breaks=BREAKS):
+        self.vowels = frozenset(vowels)
+        self.pauses = frozenset(pauses)
+        self.silences = frozenset(silences)
+        self.breaks = frozenset(breaks)
+        # 優先度の低いものから登録して、優先度の高いもので上書きする
+        d = {}
+        for p1, phonemes in (
+            ('b', self.breaks),
+            ('s', self.silences),
+            ('p', self.pauses),
+            ('v', self.vowels),
+        ):
+            d.update(dict.fromkeys(phonemes, p1))
+        d['xx'] = 'xx'
+        self.map = d
+
+    @classmethod
+    def from_conf(cls, hts_conf=None) -> 'PhonemeClassifier':
+        """
+        音素分類用の辞書 (utaupy.table.load_conf_file の戻り値) や
+        utaupy.table.CompiledTable から PhonemeClassifier を返す。
+        同じ分類に対しては同じインスタンスを使い回す。
+        """
+        if isinstance(hts_conf, PhonemeClassifier):
+            return hts_conf
+        if hts_conf is None:
+            return DEFAULT_PHONEME_CLASSIFIER
+        if isinstance(hts_conf, dict):
+            sets = (
+                frozenset(hts_conf['VOWELS']),
+                frozenset(hts_conf['PAUSES']),
+                frozenset(hts_conf['SILENCES']),
+                frozenset(hts_conf['BREAKS']),
+            )
+        else:
+            sets = (hts_conf.vowels, hts_conf.pauses, hts_conf.silences, hts_conf.breaks)
+        return _cached_phoneme_classifier(*sets)
+
+    def classify(self, identity: str) -> str:
+        """
+        音素記号1つの p1 を返す。
+        """
+        return self.map.get(identity, 'c')
+
+    def classify_many(self, identities) -> list:
+        """
+        複数の音素記号の p1 をまとめて返す。
+        """
+        return list(map(self.map.get, identities, repeat('c')))
+
+    def is_vowel(self, identity: str) -> bool:
+        """
+        音素記号が母音かどうか
+        """
+        return self.classify(identity) == 'v'
+
+    def is_rest(self, identity: str) -> bool:
+        """
+        音素記号が休符かどうか
+        """
+        return self.classify(identity) in REST_CLASSES
+
+    def is_break(self, identity: str) -> bool:
+        """
+        音素記号が息継ぎかどうか
+        """
+        return self.classify(identity) == 'b'
+
+
+@lru_cache(maxsize=32)
+def _cached_phoneme_classifier(vowels, pauses, silences, breaks) -> PhonemeClassifier:
+    return PhonemeClassifier(vowels, pauses, silences, breaks)
+
+
+DEFAULT_PHONEME_CLASSIFIER = PhonemeClassifier()
 
 
 def adjust_pau_contexts(full_label: HTSFullLabel, strict: bool = True) -> HTSFullLabel:
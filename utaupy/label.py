@@ -4,9 +4,18 @@
 """
 
 import logging
-from collections import UserList
+from bisect import bisect_right
+from collections import UserList, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from glob import glob
+from math import fsum
+from os.path import basename, isfile, join
 from typing import Optional, Union
 
+# compare() で集計する、許容誤差の閾値(ms)
+COMPARE_TOLERANCES_MS = (10, 20, 50)
+
 
 def main():
     """
@@ -18,28 +27,58 @@ def main():
     print(label)
 
 
-def load_as_plainlist(path, mode='r', encoding='utf-8', time_unit='100ns'):
+def _load_columns(path, mode='r', encoding='utf-8', time_unit='100ns'):
     """
-    labファイルを ふつうの2次元リストとして読み取る。
-    旧バージョンの utaupy.label.load() に近い動作をする。
+    labファイルを一括で読み取って、開始時刻・終了時刻・発音の3つのリストにする。
+    時刻は100ns単位の整数にする。
     """
-    # labファイルを読み取り
+    path = str(path).strip('"')
+    # ファイル全体を一度に読み取る
     with open(path, mode=mode, encoding=encoding) as f:
-        lines = [s.strip().split() for s in f.readlines()]
-    # 入力ファイル末尾の空白行を除去
-    while lines[-1] == ['']:
-        del lines[-1]
+        text = f.read()
+    # 改行を目印の項目に置き換えて、ファイル全体を1回で分割する。
+    # すべての行が「開始時刻 終了時刻 発音」の3項目なら、目印は4項目ごとに並ぶ。
+    tokens = []
+    if '\0' not in text:
+        tokens = f'{text.rstrip()}\n'.replace('\n', ' \0 ').split()
+    num_lines = len(tokens) // 4
+    if (
+        num_lines > 0
+        and len(tokens) % 4 == 0
+        and tokens[3::4].count('\0') == num_lines
+        and tokens.count('\0') == num_lines
+    ):
+        starts, ends, symbols = tokens[0::4], tokens[1::4], tokens[2::4]
+    # 空行や、発音記号に空白を含む行があるときは、行ごとに分割する
+    else:
+        lines = text.splitlines()
+        rows = [row for row in (line.split(maxsplit=2) for line in lines) if row]
+        for row in rows:
+            if len(row) < 3:
+                raise ValueError(f'Each line must have start, end and symbol.: {" ".join(row)}')
+        starts, ends, symbols = ([row[i] for row in rows] for i in range(3))
+        symbols = [symbol.rstrip() for symbol in symbols]
 
-    # リストにする [[開始時刻, 終了時刻, 発音], [], ...]
     if time_unit in ('s', 'sec', 'second'):
         # きりたんDBのモノラベル形式の場合、時刻が 0.0000000[s] なのでfloatを経由する。
-        l = [[int(10000000 * float(v[0])), int(10000000 * float(v[1])), v[2]] for v in lines]
+        starts = [int(10000000 * t) for t in map(float, starts)]
+        ends = [int(10000000 * t) for t in map(float, ends)]
     elif time_unit in ('100ns', 'subus', 'subμs'):
         # Sinsyのモノラベル形式の場合、時刻が 1234567[100ns] なのでintにする。
-        l = [[int(v[0]), int(v[1]), v[2]] for v in lines]
+        starts = list(map(int, starts))
+        ends = list(map(int, ends))
     else:
         raise ValueError('function argument "time_unit" must be in ["100ns" (recommended), "s"]')
-    return l
+    return starts, ends, symbols
+
+
+def load_as_plainlist(path, mode='r', encoding='utf-8', time_unit='100ns'):
+    """
+    labファイルを ふつうの2次元リストとして読み取る。
+    旧バージョンの utaupy.label.load() に近い動作をする。
+    """
+    # リストにする [[開始時刻, 終了時刻, 発音], [], ...]
+    return list(map(list, zip(*_load_columns(path, mode, encoding, time_unit))))
 
 
 def load(path, mode='r', encoding='utf-8', time_unit='100ns'):
@@ -47,38 +86,137 @@ def load(path, mode='r', encoding='utf-8', time_unit='100ns'):
     labファイルを読み取って Label クラスオブジェクトにする
     時刻を整数にすることに注意
     """
-    path = str(path).strip('"')
-    # lab ファイル読み取り
-    with open(path, mode=mode, encoding=encoding) as f:
-        lines = [s.strip().split(maxsplit=2) for s in f.readlines()]
-    # 入力ファイル末尾の空白行を除去
-    while lines[-1] == ['']:
-        del lines[-1]
-
     label = Label()
-    # label.original_path = path
-    # リストにする [[開始時刻, 終了時刻, 発音], [], ...]
-    if time_unit in ('s', 'sec', 'second'):
-        for v in lines:
-            phoneme = Phoneme()
-            phoneme.start = int(10000000 * float(v[0]))
-            phoneme.end = int(10000000 * float(v[1]))
-            phoneme.symbol = v[2]
-            label.append(phoneme)
-
-    # Sinsyのモノラベル形式の場合、時刻が 1234567[100ns] なのでintにする。
-    elif time_unit in ('100ns', 'subus', 'subμs'):
-        for v in lines:
-            phoneme = Phoneme()
-            phoneme.start = int(v[0])
-            phoneme.end = int(v[1])
-            phoneme.symbol = v[2]
-            label.append(phoneme)
-    else:
-        raise ValueError('function argument "time_unit" must be in ["100ns" (recommended), "s"]')
+    label.data = list(map(Phoneme, *_load_columns(path, mode, encoding, time_unit)))
     return label
 
 
+def _percentile(sorted_values: list, q: float) -> float:
+    """
+    ソート済みのリストからパーセンタイル値を線形補間で求める。
+    """
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    lower_value = sorted_values[lower]
+    return lower_value + (sorted_values[upper] - lower_value) * (position - lower)
+
+
+def _summarize_errors(errors_100ns: list) -> dict:
+    """
+    境界誤差(100ns)のリストを集計して、ms単位の統計値の辞書にする。
+    """
+    if len(errors_100ns) == 0:
+        summary = {'count': 0, 'mean': None, 'median': None, 'p90': None, 'p95': None, 'max': None}
+        summary.update({f'within_{t}ms': None for t in COMPARE_TOLERANCES_MS})
+        return summary
+    errors_ms = sorted(e / 10000 for e in errors_100ns)
+    count = len(errors_ms)
+    summary = {
+        'count': count,
+        'mean': fsum(errors_ms) / count,
+        'median': _percentile(errors_ms, 50),
+        'p90': _percentile(errors_ms, 90),
+        'p95': _percentile(errors_ms, 95),
+        'max': errors_ms[-1],
+    }
+    # 許容誤差以内に収まっている境界の割合(%)
+    for t in COMPARE_TOLERANCES_MS:
+        summary[f'within_{t}ms'] = 100 * bisect_right(errors_ms, t) / count
+    return summary
+
+
+def _boundary_errors(ref, hyp) -> list:
+    """
+    音素記号の並びで2つのラベルを対応付けて、
+    発声開始時刻(音素境界)の誤差を [(音素記号, 誤差[100ns]), ...] のリストで返す。
+    """
+    ref_phonemes = list(ref)
+    hyp_phonemes = list(hyp)
+    ref_symbols = [phoneme.symbol for phoneme in ref_phonemes]
+    hyp_symbols = [phoneme.symbol for phoneme in hyp_phonemes]
+    # 音素の並びが一致するときは対応付けを省略する
+    if ref_symbols == hyp_symbols:
+        blocks = [(0, 0, len(ref_symbols))]
+    else:
+        matcher = SequenceMatcher(None, ref_symbols, hyp_symbols, autojunk=False)
+        blocks = matcher.get_matching_blocks()
+    errors = []
+    for i, j, size in blocks:
+        errors += [
+            (ph_ref.symbol, abs(ph_hyp.start - ph_ref.start))
+            for ph_ref, ph_hyp in zip(ref_phonemes[i : i + size], hyp_phonemes[j : j + size])
+        ]
+    return errors
+
+
+def _summarize_boundary_errors(errors: list) -> dict:
+    """
+    _boundary_errors() の結果を、全体と音素記号ごとに集計する。
+    """
+    errors_by_symbol = defaultdict(list)
+    for symbol, error in errors:
+        errors_by_symbol[symbol].append(error)
+    return {
+        'all': _summarize_errors([error for _, error in errors]),
+        'phonemes': {
+            symbol: _summarize_errors(l) for symbol, l in sorted(errors_by_symbol.items())
+        },
+    }
+
+
+def compare(ref, hyp) -> dict:
+    """
+    正解ラベル(ref)と比較対象のラベル(hyp)の音素境界の誤差を集計する。
+    音素記号の並びで対応付けるため、音素の挿入や脱落があってもよい。
+
+    返り値は {'all': 全体の集計, 'phonemes': {音素記号: 音素ごとの集計}} の辞書。
+    各集計は count, mean, median, p90, p95, max (ms) と
+    within_10ms, within_20ms, within_50ms (%) からなる。
+    """
+    return _summarize_boundary_errors(_boundary_errors(ref, hyp))
+
+
+def _boundary_errors_from_paths(path_ref, path_hyp, time_unit):
+    """
+    compare_dir() でプロセスごとに実行する処理。
+    """
+    ref = load(path_ref, time_unit=time_unit)
+    hyp = load(path_hyp, time_unit=time_unit)
+    return _boundary_errors(ref, hyp)
+
+
+def compare_dir(ref_dir, hyp_dir, time_unit='100ns', max_workers=None) -> dict:
+    """
+    2つのフォルダ内の同名のLABファイルどうしを比較して、
+    コーパス全体の音素境界の誤差を集計する。
+    ファイルの読み取りと対応付けは複数プロセスで並列に行う。
+
+    返り値は compare() と同じ形式の辞書に、
+    比較したファイル数 'num_files' を加えたもの。
+    """
+    pairs = []
+    for path_ref in sorted(glob(join(str(ref_dir).strip('"'), '*.lab'))):
+        path_hyp = join(str(hyp_dir).strip('"'), basename(path_ref))
+        if isfile(path_hyp):
+            pairs.append((path_ref, path_hyp))
+        else:
+            logging.warning('比較対象のLABファイルがありません : %s', path_hyp)
+
+    errors = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_boundary_errors_from_paths, path_ref, path_hyp, time_unit)
+            for path_ref, path_hyp in pairs
+        ]
+        for future in futures:
+            errors += future.result()
+
+    result = _summarize_boundary_errors(errors)
+    result['num_files'] = len(pairs)
+    return result
+
+
 class Label(UserList):
     """
     歌唱ラベルLABファイルを想定したクラス(2019/04/19から)
@@ -251,6 +389,91 @@ class Label(UserList):
             phoneme.start = round(phoneme.start / step_size) * step_size
             phoneme.end = round(phoneme.end / step_size) * step_size
 
+    def merge_repeats(self):
+        """
+        同じ音素記号が連続する行を1つにまとめた、新しい Label を返す。
+        """
+        new_label = Label()
+        previous_phoneme = None
+        for phoneme in self.data:
+            if previous_phoneme is not None and phoneme.symbol == previous_phoneme.symbol:
+                previous_phoneme.end = phoneme.end
+            else:
+                previous_phoneme = Phoneme(phoneme.start, phoneme.end, phoneme.symbol)
+                new_label.data.append(previous_phoneme)
+        return new_label
+
+    def split_at(self, times) -> list:
+        """
+        指定した時刻(100ns)でラベルを区切って、新しい Label のリストを返す。
+        区切る時刻をまたぐ音素は、その時刻で2つに分割する。
+        ラベルの範囲外の時刻は無視する。
+        """
+        data = self.data
+        if len(data) == 0:
+            return [Label()]
+        times = sorted({t for t in times if data[0].start < t < data[-1].end})
+        labels = [Label()]
+        i = 0
+        for phoneme in data:
+            start = phoneme.start
+            # 音素の境界で区切るとき
+            while i < len(times) and times[i] <= start:
+                labels.append(Label())
+                i += 1
+            # 音素の途中で区切るとき
+            while i < len(times) and times[i] < phoneme.end:
+                labels[-1].data.append(Phoneme(start, times[i], phoneme.symbol))
+                labels.append(Label())
+                start = times[i]
+                i += 1
+            labels[-1].data.append(Phoneme(start, phoneme.end, phoneme.symbol))
+        return labels
+
+    def trim_silence(self, symbols=('sil', 'pau')):
+        """
+        先頭と末尾の無音(sil, pau など)を取り除いた、新しい Label を返す。
+        """
+        data = self.data
+        i, j = 0, len(data)
+        while i < j and data[i].symbol in symbols:
+            i += 1
+        while j > i and data[j - 1].symbol in symbols:
+            j -= 1
+        new_label = Label()
+        new_label.data = [Phoneme(ph.start, ph.end, ph.symbol) for ph in data[i:j]]
+        return new_label
+
+    def segment_by(self, symbols=('pau', 'sil'), max_len=None) -> list:
+        """
+        休符(pau, sil など)の位置でラベルをフレーズ単位に区切って、新しい Label のリストを返す。
+        休符は発声時間の中央で2つに分割し、前後のフレーズの両方に含める。
+        先頭と末尾の休符では区切らない。
+
+        max_len: フレーズの最大の長さ(100ns)。
+            指定したときは、この長さを超えない範囲で複数のフレーズをまとめる。
+            休符と休符の間がこの長さを超える場合は、そのまま1つのフレーズにする。
+
+        元のラベルが is_valid() を満たすとき、区切ったラベルもそれぞれ is_valid() を満たす。
+        """
+        data = self.data
+        if len(data) == 0:
+            return [Label()]
+        # 区切る候補の時刻
+        cuts = [(ph.start + ph.end) // 2 for ph in data[1:-1] if ph.symbol in symbols]
+        # 最大の長さを超えない範囲で、できるだけ後ろの候補で区切る
+        if max_len is not None:
+            selected_cuts = []
+            segment_start = data[0].start
+            previous_cut = None
+            for cut in [*cuts, data[-1].end]:
+                if cut - segment_start > max_len and previous_cut is not None:
+                    selected_cuts.append(previous_cut)
+                    segment_start = previous_cut
+                previous_cut = cut
+            cuts = selected_cuts
+        return self.split_at(cuts)
+
     def write(
         self,
         path_out,
@@ -267,7 +490,7 @@ class Label(UserList):
             lines = [f'{ph.start}{delimiter}{ph.end}{delimiter}{ph.symbol}' for ph in self]
         elif time_unit in ('s', '1s', 'sec'):
             lines = [
-                f'{ph.start:.7f} {ph.end:.7f} {ph.symbol}' for ph in self
+                f'{ph.start / 10000000:.7f} {ph.end / 10000000:.7f} {ph.symbol}' for ph in self
             ]  # 100ns -> 1s 表記変換
         else:
             raise ValueError("Argument time_unit must be '100ns' or 's'.")
@@ -287,10 +510,10 @@ class Phoneme:
     end: Optional[Union[int, float]]
     symbol: Optional[str]
 
-    def __init__(self):
-        self.start = None  # 発声開始位置
-        self.end = None  # 発声終了位置
-        self.symbol = None  # 発音記号
+    def __init__(self, start=None, end=None, symbol=None):
+        self.start = start  # 発声開始位置
+        self.end = end  # 発声終了位置
+        self.symbol = symbol  # 発音記号
 
     def __str__(self):
         return f'{self.start} {self.end} {self.symbol}'
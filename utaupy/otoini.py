@@ -4,8 +4,20 @@
 setParam用のINIファイルとデータを扱うモジュールです。
 """
 
+import os
 import re
+import shutil
+import tempfile
+import wave
+from array import array
 from collections import UserList
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from operator import add, mul
+
+# 原音設定の数値パラメータ
+PARAMETER_NAMES = ('offset', 'consonant', 'cutoff', 'preutterance', 'overlap')
 
 # TODO: setParam用のコメントファイルを扱えるようにする。
 
@@ -17,20 +29,110 @@ def main():
     print('耳ロボPとsetParamに卍感謝卍')
 
 
-def load(path, mode='r', encoding='cp932'):
+def _parse(text: str):
+    """
+    oto.ini の文字列を解析する。
+    正規表現を使わず、'=' と ',' で分割する。
+    数値の欄が空欄または不足しているときは0とし、7項目目以降はコメントとする。
+
+    返り値は (ファイル名のリスト, エイリアスのリスト, 数値パラメータごとのリスト5つ,
+              コメントのリスト, 各行の文字列のリスト, 解析できなかった [(行番号, 行), ...])
+    各行の文字列は、書き出すときにそのまま使うため、改行を除いて前後の空白も残す。
+    """
+    raw_lines = text.splitlines()
+    lines = [line.strip() for line in raw_lines]
+    parts = [line.partition('=') for line in lines]
+    rows = [rest.split(',') for _, _, rest in parts]
+    # すべての行が「ファイル名=エイリアス,数値x5」のときは、列ごとに一括で変換する
+    if lines and {len(row) for row in rows} == {6} and '' not in {sep for _, sep, _ in parts}:
+        try:
+            aliases, *columns = zip(*rows)
+            columns = [list(map(float, column)) for column in columns]
+        except ValueError:
+            pass
+        else:
+            filenames = [filename for filename, _, _ in parts]
+            return filenames, list(aliases), columns, [None] * len(lines), raw_lines, []
+
+    # 空欄や不正な行を含むときは1行ずつ処理する
+    filenames = []
+    aliases = []
+    values = []
+    comments = []
+    source_lines = []
+    malformed_lines = []
+    padding = ('',) * len(PARAMETER_NAMES)
+    for line_number, ((filename, separator, _), (alias, *fields)) in enumerate(
+        zip(parts, rows), 1
+    ):
+        # 空白行は無視する
+        if not (filename or separator):
+            continue
+        if not separator:
+            malformed_lines.append((line_number, lines[line_number - 1]))
+            continue
+        try:
+            values.append(
+                [float(v) if v else 0.0 for v in (*fields[:5], *padding[len(fields) :])]
+            )
+        except ValueError:
+            malformed_lines.append((line_number, lines[line_number - 1]))
+            continue
+        filenames.append(filename)
+        aliases.append(alias)
+        comments.append(','.join(fields[5:]) if len(fields) > 5 else None)  # noqa: PLR2004
+        source_lines.append(raw_lines[line_number - 1])
+    columns = [list(column) for column in zip(*values)] if values else [[] for _ in padding]
+    return filenames, aliases, columns, comments, source_lines, malformed_lines
+
+
+@lru_cache(maxsize=4096)
+def _read_wav_duration(path: str, mtime_ns: int, size: int) -> float:
+    """
+    WAVファイルのヘッダだけを読んで長さ(ms)を返す。
+    更新日時とファイルサイズが同じなら前回の結果を使う。
+    """
+    with wave.open(path, 'rb') as wav:
+        return 1000 * wav.getnframes() / wav.getframerate()
+
+
+def wav_duration(path):
+    """
+    WAVファイルの長さ(ms)を返す。ファイルが無いときは None を返す。
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return _read_wav_duration(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def load(path, mode='r', encoding='cp932', as_columns=False):
     """
     otoiniを読み取ってオブジェクト生成
+
+    as_columns: True のときは OtoIni ではなく OtoColumns を返す。
+
+    解析できなかった行は例外を出さずに読み飛ばし、
+    [(行番号, 行), ...] として返り値の malformed_lines に記録する。
     """
     # otoiniファイルを読み取る
     path = str(path).strip('"')
     with open(path, mode=mode, encoding=encoding) as f:
-        lines = [line.strip() for line in f.readlines()]
+        text = f.read()
+    filenames, aliases, columns, comments, source_lines, malformed_lines = _parse(text)
+
+    # 数値パラメータを配列として持つ OtoColumns を作る
+    if as_columns:
+        otocolumns = OtoColumns(filenames, aliases, *columns)
+        otocolumns.malformed_lines = malformed_lines
+        return otocolumns
 
     # Otoクラスオブジェクトのリストを作る
     otoini = OtoIni()
-    for line in lines:
-        params = re.split('[=,]', line.strip())
-        params = params[:2] + [float(v) for v in params[2:]]
+    otoini.malformed_lines = malformed_lines
+    l = []
+    for params, source_line in zip(zip(filenames, aliases, *columns, comments), source_lines):
         oto = Oto()
         (
             oto.filename,
@@ -40,22 +142,222 @@ def load(path, mode='r', encoding='cp932'):
             oto.cutoff,
             oto.preutterance,
             oto.overlap,
+            oto.comment,
         ) = params
-        otoini.append(oto)
+        # 書き出すときに、変更がなければ元の行をそのまま使う
+        oto._source_line = source_line  # noqa: SLF001
+        oto._source_values = params  # noqa: SLF001
+        l.append(oto)
+    otoini.data = l
     return otoini
 
 
+def _mono_oto(filename: str, alias: str, offset) -> 'Oto':
+    """
+    モノフォン化した Oto を生成する。先行発声は0。
+    """
+    mono_oto = Oto()
+    mono_oto.filename = filename
+    mono_oto.alias = alias
+    mono_oto.offset = offset
+    mono_oto.preutterance = 0
+    return mono_oto
+
+
+def iter_monophones(otos):
+    """
+    Oto を1つずつ音素ごとに分割して返すジェネレータ。
+    OtoIni.monophonize() と同じ処理で、入力は書き換えない。
+    音素の発声開始位置: 左ブランク=先行発声
+    """
+    for oto in otos:
+        phonemes = oto.alias.split()
+        if len(phonemes) == 1:
+            yield oto
+        elif len(phonemes) in [2, 3]:
+            name_wav = oto.filename
+            # 1文字目(オーバーラップから先行発声まで)------------
+            # オーバーラップの位置に左ブランクを移動
+            yield _mono_oto(name_wav, phonemes[0], oto.offset + oto.overlap)
+            # 2文字目(先行発声から固定範囲まで)----------------
+            # 先行発声の位置に左ブランクを移動
+            yield _mono_oto(name_wav, phonemes[1], oto.offset + oto.preutterance)
+            if len(phonemes) == 3:
+                # 3文字目(固定範囲から右ブランクまで)----------------
+                # 固定範囲の位置に左ブランクを移動
+                yield _mono_oto(name_wav, phonemes[2], oto.offset + oto.consonant)
+        else:
+            print('\n[ERROR in otoini.monophonize()]----------------')
+            print('  1エイリアスの音素数は 1, 2, 3 以外対応していません。')
+            print(f'  phonemes: {phonemes}')
+            print('  文字を連結して処理を続行します。')
+            print('-----------------------------------------------\n')
+            yield oto
+
+
 class OtoIni(UserList):
     """
     oto.iniを想定したクラス
+
+    エイリアス → Oto (最初に出現したもの) と、ファイル名 → [Oto, ...] の索引を持ち、
+    エイリアスでの検索を辞書引きで行う。
+    索引は append(), extend() で更新し、それ以外の編集では次の検索時に作りなおす。
+    索引に登録した Oto のエイリアスが書き換えられたときも、次の検索時に作りなおす。
+    data の中身を直接書き換えたときは reindex() を実行すること。
     """
 
+    def __init__(self, initlist=None):
+        self._alias_index = None
+        self._filename_index = None
+        # 索引を作ったときの Oto.alias_version
+        self._index_version = None
+        # load() で解析できなかった行 [(行番号, 行), ...]
+        self.malformed_lines = []
+        super().__init__(initlist)
+
+    @property
+    def data(self) -> list:
+        """
+        Otoのリスト
+        """
+        return self._data
+
+    @data.setter
+    def data(self, l: list):
+        self._data = l
+        self.reindex()
+
+    def reindex(self):
+        """
+        索引を破棄して、次の検索時に作りなおすようにする。
+        """
+        self._alias_index = None
+        self._filename_index = None
+
+    def _build_index(self):
+        """
+        エイリアスとファイル名の索引を作る。
+        """
+        alias_index = {}
+        filename_index = {}
+        for oto in self._data:
+            oto._indexed = True  # noqa: SLF001
+            alias_index.setdefault(oto.alias, oto)
+            filename_index.setdefault(oto.filename, []).append(oto)
+        self._alias_index = alias_index
+        self._filename_index = filename_index
+        self._index_version = Oto.alias_version
+
+    @property
+    def alias_index(self) -> dict:
+        """
+        エイリアス → Oto の辞書。同じエイリアスが複数あるときは最初のもの。
+        """
+        if self._alias_index is None or self._index_version != Oto.alias_version:
+            self._build_index()
+        return self._alias_index
+
+    @property
+    def filename_index(self) -> dict:
+        """
+        ファイル名 → [Oto, ...] の辞書。
+        """
+        if self._filename_index is None:
+            self._build_index()
+        return self._filename_index
+
+    def __contains__(self, item):
+        if isinstance(item, str):
+            return self.get(item) is not None
+        return super().__contains__(item)
+
+    def __getitem__(self, i):
+        if isinstance(i, str):
+            oto = self.get(i)
+            if oto is None:
+                raise KeyError(i)
+            return oto
+        return super().__getitem__(i)
+
+    def __setitem__(self, i, item):
+        super().__setitem__(i, item)
+        self.reindex()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.reindex()
+
+    def append(self, item):
+        super().append(item)
+        if self._alias_index is not None:
+            item._indexed = True  # noqa: SLF001
+            self._alias_index.setdefault(item.alias, item)
+            self._filename_index.setdefault(item.filename, []).append(item)
+
+    def extend(self, other):
+        if self._alias_index is None:
+            super().extend(other)
+            return
+        for item in other:
+            self.append(item)
+
+    def insert(self, i, item):
+        super().insert(i, item)
+        self.reindex()
+
+    def pop(self, i=-1):
+        item = super().pop(i)
+        self.reindex()
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self.reindex()
+
+    def clear(self):
+        super().clear()
+        self.reindex()
+
+    def reverse(self):
+        super().reverse()
+        self.reindex()
+
+    def sort(self, /, *args, **kwds):
+        super().sort(*args, **kwds)
+        self.reindex()
+
+    def get(self, alias: str, default=None):
+        """
+        エイリアスに対応する Oto を返す。なければ default を返す。
+        索引に登録した Oto のエイリアスが書き換えられていたら、索引を作りなおしてから探す。
+        """
+        oto = self.alias_index.get(alias)
+        # data を直接書き換えたなどで索引が古いときも、誤った Oto は返さない
+        if oto is not None and oto.alias != alias:
+            self._build_index()
+            oto = self._alias_index.get(alias)
+        return default if oto is None else oto
+
+    def get_many(self, aliases, default=None) -> list:
+        """
+        複数のエイリアスに対応する Oto のリストを返す。なければ default にする。
+        """
+        get = self.get
+        return [get(alias, default) for alias in aliases]
+
+    def get_by_filename(self, filename: str) -> list:
+        """
+        ファイル名に対応する Oto のリストを返す。
+        """
+        return list(self.filename_index.get(filename, []))
+
     def replace_aliases(self, before, after):
         """
         エイリアスを置換する
         """
         for oto in self:
             oto.alias = oto.alias.replace(before, after)
+        self.reindex()
         return self
 
     def apply_regex(self, func, *args, pattern=None):
@@ -86,17 +388,16 @@ class OtoIni(UserList):
         Parameters:
             keep (str): 'first' の時は最初の行を残し、'last' の時は最後の行を残す。
         """
-        seen_aliases = set()  # 確認済みのエイリアス
-        index_map = {}  # 最初または最後の出現位置
-
-        for index, oto in enumerate(self):
-            # firstのとき
-            if keep == 'first':
-                if oto.alias not in seen_aliases:
-                    seen_aliases.add(oto.alias)
-                    index_map[oto.alias] = index
-            # lastのとき
-            elif keep == 'last':
+        # firstのときは索引がそのまま使える
+        if keep == 'first':
+            self._build_index()
+            self.data = list(self._alias_index.values())
+            return self
+
+        index_map = {}  # 最後の出現位置
+        # lastのとき
+        if keep == 'last':
+            for index, oto in enumerate(self):
                 index_map[oto.alias] = index
 
         unique_otoini = [self[index] for index in sorted(index_map.values())]
@@ -166,6 +467,13 @@ class OtoIni(UserList):
 
         return self.apply_regex(overlap_ratio_func, pattern=pattern)
 
+    def as_columns(self):
+        """
+        数値パラメータを配列として持つ OtoColumns に変換する。
+        編集後に OtoColumns.commit() を実行すると、このOtoIniに書き戻す。
+        """
+        return OtoColumns.from_otoini(self)
+
     def is_mono(self):
         """
         モノフォン形式のエイリアスになっているか判定する。
@@ -180,73 +488,301 @@ class OtoIni(UserList):
         otoini→label 変換の用途を想定
         音素の発声開始位置: 左ブランク=先行発声
         """
-        # 新規OtoIniを作るために、otoを入れるリスト
-        mono_otoini = OtoIni()
-        for oto in self:
-            phonemes = oto.alias.split()
-            if len(phonemes) == 1:
-                mono_otoini.append(oto)
-            elif len(phonemes) in [2, 3]:
-                name_wav = oto.filename
-                # 1文字目(オーバーラップから先行発声まで)------------
-                mono_oto = Oto()
-                mono_oto.filename = name_wav
-                mono_oto.alias = phonemes[0]
-                mono_oto.offset = (
-                    oto.offset + oto.overlap
-                )  # オーバーラップの位置に左ブランクを移動
-                mono_oto.preutterance = 0
-                mono_otoini.append(mono_oto)
-                # 2文字目(先行発声から固定範囲まで)----------------
-                mono_oto = Oto()
-                mono_oto.filename = name_wav
-                mono_oto.alias = phonemes[1]
-                mono_oto.offset = oto.offset + oto.preutterance  # 先行発声の位置に左ブランクを移動
-                mono_oto.preutterance = 0
-                mono_otoini.append(mono_oto)
-                if len(phonemes) == 3:
-                    # 3文字目(固定範囲から右ブランクまで)----------------
-                    mono_oto = Oto()
-                    mono_oto.filename = name_wav
-                    mono_oto.alias = phonemes[2]
-                    mono_oto.offset = (
-                        oto.offset + oto.consonant
-                    )  # 固定範囲の位置に左ブランクを移動
-                    mono_oto.preutterance = 0
-                    mono_otoini.append(mono_oto)
+        return OtoIni(iter_monophones(self))
+
+    def validate(self, voice_dir, max_workers=None) -> dict:
+        """
+        oto.ini の各エントリを音声ファイルと照合する。
+        WAVファイルはヘッダだけを読み、ファイルごとに1回だけ複数スレッドで読む。
+
+        返り値は次の辞書。
+            'durations': {ファイル名: 長さ(ms)}
+            'missing'  : [見つからないファイル名, ...]
+            'issues'   : [{'index', 'filename', 'alias', 'message'}, ...]
+        """
+        voice_dir = str(voice_dir).strip('"')
+        filenames = list(dict.fromkeys(oto.filename for oto in self))
+        paths = [os.path.join(voice_dir, filename) for filename in filenames]
+
+        def _duration_or_error(path):
+            try:
+                return wav_duration(path)
+            # フォルダや権限のないファイルも、そのファイルの問題として報告する
+            except (wave.Error, EOFError, ZeroDivisionError, OSError) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(filenames, executor.map(_duration_or_error, paths)))
+
+        durations = {}
+        missing = []
+        issues = []
+        for filename, result in results.items():
+            if result is None:
+                missing.append(filename)
+            elif isinstance(result, Exception):
+                issues.append(
+                    {
+                        'index': None,
+                        'filename': filename,
+                        'alias': None,
+                        'message': f'Unreadable WAV file : {result!r}',
+                    }
+                )
             else:
-                print('\n[ERROR in otoini.monophonize()]----------------')
-                print('  1エイリアスの音素数は 1, 2, 3 以外対応していません。')
-                print(f'  phonemes: {phonemes}')
-                print('  文字を連結して処理を続行します。')
-                print('-----------------------------------------------\n')
-                mono_otoini.append(oto)
-        return mono_otoini
+                durations[filename] = result
+
+        for i, oto in enumerate(self):
+            duration = durations.get(oto.filename)
+            if duration is None:
+                continue
+            for message in oto.check(duration):
+                issues.append(
+                    {'index': i, 'filename': oto.filename, 'alias': oto.alias, 'message': message}
+                )
+        return {'durations': durations, 'missing': missing, 'issues': issues}
+
+    @property
+    def modified_otos(self) -> list:
+        """
+        読み取ったときから値が変更された、または新しく追加された Oto のリスト
+        """
+        return [oto for oto in self if oto.is_modified()]
 
     def write(self, path, mode='w', encoding='cp932'):
         """
         ファイル出力
+        変更のない行は読み取ったときの文字列をそのまま使い、変更された行だけ書式を整える。
+        mode='w' のときは一時ファイルに書き出してから置き換える。
         """
-        s = '\n'.join([str(oto) for oto in self]) + '\n'
-        with open(path, mode=mode, encoding=encoding) as f:
-            f.write(s)
+        s = '\n'.join([oto.as_line() for oto in self]) + '\n'
+        if mode != 'w':
+            with open(path, mode=mode, encoding=encoding) as f:
+                f.write(s)
+            return s
+        # 書き込みに失敗しても元のファイルが壊れないようにする
+        fd, path_temp = tempfile.mkstemp(
+            prefix='.oto_', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path))
+        )
+        try:
+            with os.fdopen(fd, mode=mode, encoding=encoding) as f:
+                f.write(s)
+            # mkstemp のファイルは 0600 になるので、元のファイルの権限に合わせる
+            if os.path.exists(path):
+                shutil.copymode(path, path_temp)
+            os.replace(path_temp, path)
+        except BaseException:
+            os.remove(path_temp)
+            raise
         return s
 
 
+class OtoColumns:
+    """
+    原音設定の数値パラメータを、パラメータごとの配列 (array('d')) として持つクラス。
+    全行への一括編集を、Otoごとの属性の読み書きなしで行う。
+    pattern を指定する編集では、正規表現に完全一致した行の番号をパターンごとに一度だけ求める。
+    """
+
+    def __init__(
+        self,
+        filenames: list,
+        aliases: list,
+        offset,
+        consonant,
+        cutoff,
+        preutterance,
+        overlap,
+    ):
+        self.filenames = list(filenames)
+        self.aliases = list(aliases)
+        self.offset = array('d', offset)
+        self.consonant = array('d', consonant)
+        self.cutoff = array('d', cutoff)
+        self.preutterance = array('d', preutterance)
+        self.overlap = array('d', overlap)
+        # 書き戻し先のOtoのリスト
+        self._otos = None
+        # 正規表現のパターン → 完全一致した行番号のリスト
+        self._masks = {}
+        # load() で解析できなかった行 [(行番号, 行), ...]
+        self.malformed_lines = []
+
+    def __len__(self):
+        return len(self.aliases)
+
+    @classmethod
+    def from_otoini(cls, otoini):
+        """
+        OtoIni から生成する。commit() でもとの Oto に書き戻せる。
+        """
+        otos = list(otoini)
+        columns = cls(
+            [oto.filename for oto in otos],
+            [oto.alias for oto in otos],
+            *([float(getattr(oto, name)) for oto in otos] for name in PARAMETER_NAMES),
+        )
+        columns._otos = otos  # noqa: SLF001
+        return columns
+
+    def mask(self, pattern: str) -> list:
+        """
+        エイリアスが正規表現に完全一致した行番号のリストを返す。
+        """
+        if pattern not in self._masks:
+            fullmatch = re.compile(rf'{pattern}').fullmatch
+            self._masks[pattern] = [i for i, alias in enumerate(self.aliases) if fullmatch(alias)]
+        return self._masks[pattern]
+
+    def _map(self, name: str, func, *args, pattern=None):
+        """
+        パラメータの配列の各値に func を適用する。
+        args は各値に共通の引数。
+        """
+        column = getattr(self, name)
+        if pattern is None:
+            column[:] = array('d', map(func, column, *map(repeat, args)))
+            return
+        indices = self.mask(pattern)
+        new_values = map(func, [column[i] for i in indices], *map(repeat, args))
+        for i, value in zip(indices, new_values):
+            column[i] = value
+
+    def round(self, digits=3, pattern=None):
+        """
+        小数点以下の桁数を指定して四捨五入する。
+        """
+        digits = int(digits)
+        for name in PARAMETER_NAMES:
+            self._map(name, round, digits, pattern=pattern)
+        return self
+
+    def scale(self, factor: float, names=PARAMETER_NAMES, pattern=None):
+        """
+        指定したパラメータを factor 倍する。
+        """
+        for name in names:
+            self._map(name, mul, float(factor), pattern=pattern)
+        return self
+
+    def shift(self, value: float, names=('offset',), pattern=None):
+        """
+        指定したパラメータに value を足す。
+        """
+        for name in names:
+            self._map(name, add, float(value), pattern=pattern)
+        return self
+
+    def update(self, name: str, func, pattern=None):
+        """
+        パラメータ name を、func の返り値で上書きする。
+        func は offset, consonant, cutoff, preutterance, overlap をキーワード引数で受け取る。
+
+        Example of Use:
+            # オーバーラップを先行発声の1/3にする
+            columns.update('overlap', lambda preutterance, **_: preutterance / 3)
+        """
+        indices = range(len(self)) if pattern is None else self.mask(pattern)
+        columns = [getattr(self, n) for n in PARAMETER_NAMES]
+        new_values = [
+            func(**dict(zip(PARAMETER_NAMES, [column[i] for column in columns])))
+            for i in indices
+        ]
+        column = getattr(self, name)
+        for i, value in zip(indices, new_values):
+            column[i] = value
+        return self
+
+    def init_overlap_ratio(self, bpm=120, preutterance=None, ratio=1 / 3, pattern=None):
+        """
+        OtoIni.init_overlap_ratio() と同じ処理を一括で行う。
+        """
+        if preutterance is not None:
+            new_preutterance = float(preutterance)
+        else:
+            new_preutterance = (60000 / float(bpm)) / 2
+        new_overlap = new_preutterance * ratio
+
+        indices = range(len(self)) if pattern is None else self.mask(pattern)
+        offset, consonant, cutoff = self.offset, self.consonant, self.cutoff
+        preutterances = self.preutterance
+        for i in indices:
+            moving_value = preutterances[i] - new_preutterance
+            offset[i] += moving_value
+            consonant[i] -= moving_value
+            # マイナス値のcutoffは、offsetと連動して動く
+            if cutoff[i] < 0:
+                cutoff[i] += moving_value
+            preutterances[i] = new_preutterance
+            self.overlap[i] = new_overlap
+        return self
+
+    def commit(self):
+        """
+        編集した値を、生成元の OtoIni の Oto に書き戻す。
+        """
+        if self._otos is None:
+            raise ValueError('This OtoColumns was not created from an OtoIni.')
+        for oto, *values in zip(self._otos, *(getattr(self, n) for n in PARAMETER_NAMES)):
+            (oto.offset, oto.consonant, oto.cutoff, oto.preutterance, oto.overlap) = values
+        return self
+
+    def to_otoini(self) -> OtoIni:
+        """
+        新しい OtoIni を生成する。
+        """
+        otoini = OtoIni()
+        for row in zip(self.filenames, self.aliases, *(getattr(self, n) for n in PARAMETER_NAMES)):
+            oto = Oto()
+            (
+                oto.filename,
+                oto.alias,
+                oto.offset,
+                oto.consonant,
+                oto.cutoff,
+                oto.preutterance,
+                oto.overlap,
+            ) = row
+            otoini.append(oto)
+        return otoini
+
+
 class Oto:
     """
     oto.ini中の1モーラ
     """
 
+    # OtoIni の索引に登録された Oto のエイリアスが書き換えられた回数。
+    # OtoIni はこれが索引を作ったときから変わっていたら索引を作りなおす。
+    alias_version = 0
+
     def __init__(self):
+        # OtoIni の索引に登録されたかどうか
+        self._indexed = False
         self.filename: str = ''
-        self.alias: str = ''
+        self._alias: str = ''
         self.offset = 0
         self.consonant = 0
         self.cutoff = 0
         self.preutterance = 0
         self.overlap = 0
         self.comment = None
+        # ファイルから読み取ったときの行と値
+        self._source_line = None
+        self._source_values = None
+
+    @property
+    def alias(self) -> str:
+        """
+        エイリアス
+        """
+        return self._alias
+
+    @alias.setter
+    def alias(self, alias: str):
+        if self._indexed and alias != self._alias:
+            Oto.alias_version += 1
+        self._alias = alias
 
     def __str__(self):
         s = '{}={},{},{},{},{},{}'.format(  # noqa: UP032
@@ -260,6 +796,64 @@ class Oto:
         )
         return s  # noqa: RET504
 
+    def is_modified(self) -> bool:
+        """
+        ファイルから読み取ったときから値が変更されたかどうか
+        """
+        return self._source_values != (
+            self.filename,
+            self.alias,
+            self.offset,
+            self.consonant,
+            self.cutoff,
+            self.preutterance,
+            self.overlap,
+            self.comment,
+        )
+
+    def as_line(self) -> str:
+        """
+        oto.ini の1行として出力する文字列。
+        値に変更がなければ、読み取ったときの行をそのまま返す。
+        """
+        if self._source_line is not None and not self.is_modified():
+            return self._source_line
+        if self.comment is None:
+            return str(self)
+        return f'{self},{self.comment}'
+
+    def check(self, duration: float) -> list:
+        """
+        音声ファイルの長さ(ms)と照合して、問題点を説明する文字列のリストを返す。
+        """
+        messages = []
+        fixed_end = self.offset + self.consonant
+        # 右ブランクが正の値のときはファイル末尾からの長さ、0のときはファイル末尾
+        absolute_cutoff = duration - self.cutoff if self.cutoff >= 0 else self.cutoff2
+        if self.offset < 0:
+            messages.append(f'Offset is negative : {self.offset}')
+        if self.consonant < 0:
+            messages.append(f'Consonant is negative : {self.consonant}')
+        if fixed_end > duration:
+            messages.append(f'Offset + consonant exceeds the duration : {fixed_end} > {duration}')
+        if absolute_cutoff > duration:
+            messages.append(f'Cutoff exceeds the duration : {absolute_cutoff} > {duration}')
+        if absolute_cutoff < fixed_end:
+            messages.append(
+                f'Cutoff is before the end of consonant : {absolute_cutoff} < {fixed_end}'
+            )
+        if self.preutterance < 0:
+            messages.append(f'Preutterance is negative : {self.preutterance}')
+        if self.overlap > self.preutterance:
+            messages.append(
+                f'Overlap is larger than preutterance : {self.overlap} > {self.preutterance}'
+            )
+        if self.offset + self.preutterance > absolute_cutoff:
+            messages.append(
+                f'Preutterance is after the cutoff : {self.offset + self.preutterance} > {absolute_cutoff}'  # noqa: E501
+            )
+        return messages
+
     @property
     def cutoff2(self):
         """
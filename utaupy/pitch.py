@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+リサンプラーに渡すピッチ文字列を扱うモジュールです。
+
+ピッチ文字列の形式
+    各点の音高[cent]を12bitの2の補数にし、上位6bit・下位6bitの順に64進数の2文字で表す。
+    64進数の文字は A-Z, a-z, 0-9, +, / の順。
+    直前の値と同じ値が続くときは、続く回数を '#回数#' と書いて省略する。
+    例) 'AA#3#' は [0, 0, 0, 0]
+"""
+
+import math
+import re
+from array import array
+from itertools import accumulate, groupby, repeat
+
+BASE64_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+# 12bitの値 → 2文字 の表
+_ENCODE_TABLE = [BASE64_CHARS[x >> 6] + BASE64_CHARS[x & 0x3F] for x in range(4096)]
+# 2文字 → 符号付きの値 の表
+_DECODE_TABLE = {chars: x - 4096 if x >= 2048 else x for x, chars in enumerate(_ENCODE_TABLE)}
+_TOKEN_PATTERN = re.compile(r'#(\d+)#|([A-Za-z0-9+/]{2})')
+
+
+def main():
+    """
+    直接実行されたときの挙動
+    """
+    print('ピッチ文字列を数値に変換します。')
+    s = input('pitch string: ').strip()
+    print(decode(s).tolist())
+
+
+def encode(cents) -> str:
+    """
+    音高[cent]の配列をピッチ文字列にする。
+    値は整数に丸め、-2048 ~ 2047 の範囲に切り詰める。
+    """
+    if not (isinstance(cents, array) and cents.typecode in 'bhil'):
+        cents = map(round, cents)
+    table = _ENCODE_TABLE
+    chunks = []
+    # 同じ値の連続をまとめてから文字にする
+    for value, group in groupby(cents):
+        chunks.append(table[min(max(value, -2048), 2047) & 0xFFF])
+        count = sum(1 for _ in group)
+        if count > 1:
+            chunks.append(f'#{count - 1}#')
+    return ''.join(chunks)
+
+
+def decode(s: str) -> array:
+    """
+    ピッチ文字列を音高[cent]の配列 (array('h')) にする。
+    """
+    table = _DECODE_TABLE
+    result = array('h')
+    value = 0
+    for m in _TOKEN_PATTERN.finditer(s):
+        count, chars = m.groups()
+        if chars is not None:
+            value = table[chars]
+            result.append(value)
+        else:
+            result.extend(repeat(value, int(count)))
+    return result
+
+
+def mode2_curve(note, times_ms) -> list:
+    """
+    ノートの mode2 ピッチ (PBS, PBW, PBY, PBM) から、
+    ノートの開始位置を0とした各時刻[ms]のピッチ[cent]を求める。
+    PBY などの値は 10cent 単位。
+    """
+    pbs = note.pbs
+    if pbs is None:
+        return [0] * len(times_ms)
+    # 点の時刻と高さ
+    xs = list(accumulate([pbs[0], *(note.pbw or [])]))
+    ys = [pbs[1], *(note.pby or [])]
+    ys += [0] * (len(xs) - len(ys))
+    shapes = note.pbm or []
+    curve = []
+    i = 0
+    for t in times_ms:
+        while i < len(xs) - 1 and t >= xs[i + 1]:
+            i += 1
+        if t <= xs[0]:
+            curve.append(ys[0] * 10)
+            continue
+        if i >= len(xs) - 1:
+            curve.append(ys[-1] * 10)
+            continue
+        x0, x1, y0, y1 = xs[i], xs[i + 1], ys[i], ys[i + 1]
+        r = (t - x0) / (x1 - x0) if x1 > x0 else 1
+        shape = shapes[i] if i < len(shapes) else ''
+        # 形状: '' はS字, 's' は直線, 'r' は上に凸, 'j' は下に凸
+        if shape == 's':
+            k = r
+        elif shape == 'r':
+            k = math.sin(r * math.pi / 2)
+        elif shape == 'j':
+            k = 1 - math.cos(r * math.pi / 2)
+        else:
+            k = (1 - math.cos(r * math.pi)) / 2
+        curve.append((y0 + (y1 - y0) * k) * 10)
+    return curve
+
+
+def encode_many(curves) -> list:
+    """
+    複数のノートの音高[cent]の配列を、まとめてピッチ文字列のリストにする。
+    """
+    return list(map(encode, curves))
+
+
+def decode_many(strings) -> list:
+    """
+    複数のピッチ文字列を、まとめて音高[cent]の配列のリストにする。
+    """
+    return list(map(decode, strings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+リサンプラーで生成した音声をつなげて、歌声を合成するためのモジュールです。
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate, repeat
+from operator import add, mul
+
+from utaupy import pitch as _pitch
+
+# エンベロープが指定されていないノートに使う値 (UTAUの初期値)
+DEFAULT_ENVELOPE = (0, 5, 35, 0, 100, 100, 0, 0, 0, 100)
+# リサンプラーに渡す音名 (UTAUは # で表記する)
+NOTENAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+# ピッチ曲線の点の間隔[Ticks]
+PITCH_INTERVAL_TICKS = 5
+
+
+def read_wav(path):
+    """
+    WAVファイルを読み取り、(-1 ~ 1 の float32 の配列, サンプリング周波数) を返す。
+    16bit のモノラルとステレオに対応し、ステレオは左チャンネルだけを使う。
+    """
+    with wave.open(str(path), 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f'Only 16-bit WAV files are supported: {path}')
+        framerate = wav.getframerate()
+        num_channels = wav.getnchannels()
+        samples = array('h', wav.readframes(wav.getnframes()))
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return array('f', map(mul, samples[::num_channels], repeat(1 / 32768))), framerate
+
+
+def write_wav(path, samples, framerate: int = 44100):
+    """
+    -1 ~ 1 の値の配列を、16bit モノラルのWAVファイルとして出力する。
+    範囲外の値は切り詰める。
+    """
+    pcm = array(
+        'h', (-32768 if x < -1 else 32767 if x >= 1 else int(x * 32768) for x in samples)
+    )
+    if sys.byteorder != 'little':
+        pcm.byteswap()
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(framerate)
+        wav.writeframes(pcm.tobytes())
+
+
+def _envelope_points(envelope, num_samples: int, framerate: int) -> list:
+    """
+    エンベロープの各点を [(サンプル位置, 音量倍率), ...] にする。
+    位置は 0 以上 num_samples 以下で、前の点より後ろになるように切り詰める。
+    """
+    p1, p2, p3, v1, v2, v3, v4, p4, p5, v5 = (list(envelope) + [0, 0, 100])[:10]
+    samples_per_ms = framerate / 1000
+    # 前から p1, p2, p5, 後ろから p4, p3 の順に点を置く
+    t1, t2, t5 = (round(t * samples_per_ms) for t in accumulate((p1, p2, p5)))
+    t4 = num_samples - round(p4 * samples_per_ms)
+    t3 = t4 - round(p3 * samples_per_ms)
+    points = [(t1, v1), (t2, v2)]
+    if p5 > 0:
+        points.append((t5, v5))
+    points += [(t3, v3), (t4, v4)]
+    result = []
+    previous_t = 0
+    for t, v in points:
+        previous_t = min(max(t, previous_t), num_samples)
+        result.append((previous_t, v / 100))
+    return result
+
+
+def _ramp(gain_start: float, gain_end: float, n: int) -> array:
+    """
+    gain_start から gain_end の直前まで直線的に変化する長さ n の配列
+    """
+    if gain_start == gain_end:
+        return array('f', repeat(gain_start, n))
+    step = (gain_end - gain_start) / n
+    return array('f', (gain_start + step * k for k in range(n)))
+
+
+def envelope_gains(envelope, num_samples: int, framerate: int = 44100) -> array:
+    """
+    エンベロープを、長さ num_samples の音量倍率の配列にする。
+    p1 より前と p4 より後ろは無音とし、各点の間は直線で結ぶ。
+
+    envelope: [p1, p2, p3, v1, v2, v3, v4, p4, p5, v5]
+              utaupy.ust.Note.envelope と同じ形式。7項目の場合は p4=0, p5=0 とする。
+    """
+    gains = array('f', bytes(4 * num_samples))
+    points = _envelope_points(envelope, num_samples, framerate)
+    for (t_start, gain_start), (t_end, gain_end) in zip(points[:-1], points[1:]):
+        if t_end > t_start:
+            gains[t_start:t_end] = _ramp(gain_start, gain_end, t_end - t_start)
+    return gains
+
+
+def wavtool(
+    samples_list, lengths_ms, preutterances, overlaps, envelopes=None, framerate: int = 44100
+) -> array:
+    """
+    ノートごとの音声をエンベロープを掛けて重ね合わせ、1本の float32 の配列にする。
+    UTAUの wavtool のようにノートごとにファイルへ追記するのではなく、
+    出力全体の長さの配列を先に確保して、各ノートを所定の位置に書き込む。
+    ほかのノートと重なる部分だけ足し合わせ、音量が100%の部分はそのまま複写する。
+
+    samples_list : ノートごとの音声 (-1 ~ 1 の配列)。休符は None
+    lengths_ms   : ノートごとのUST上の長さ[ms]
+    preutterances: ノートごとの先行発声[ms]
+    overlaps     : ノートごとのオーバーラップ[ms]
+    envelopes    : ノートごとのエンベロープ。None のノートは DEFAULT_ENVELOPE を使う。
+
+    ノート i の音声は (ノートの開始時刻 - 先行発声) から置き、
+    次のノートの先行発声の位置にオーバーラップを加えた時刻までを使う。
+    """
+    num_notes = len(lengths_ms)
+    if envelopes is None:
+        envelopes = [None] * num_notes
+    samples_per_ms = framerate / 1000
+    # ノートごとの配置位置と長さ (サンプル数) を求める
+    note_starts = [0, *accumulate(lengths_ms)]
+    next_preutterances = [*preutterances[1:], 0]
+    next_overlaps = [*overlaps[1:], 0]
+    positions = []
+    segment_lengths = []
+    for i in range(num_notes):
+        start_ms = note_starts[i] - preutterances[i]
+        end_ms = note_starts[i + 1] - next_preutterances[i] + next_overlaps[i]
+        position = round(start_ms * samples_per_ms)
+        positions.append(position)
+        segment_lengths.append(max(round(end_ms * samples_per_ms) - position, 0))
+
+    # 出力全体の配列を確保してから書き込む
+    total_length = max((p + n for p, n in zip(positions, segment_lengths)), default=0)
+    output = array('f', bytes(4 * total_length))
+    # output[:written_until] より後ろには、まだ何も書き込まれていない
+    written_until = 0
+    for samples, position, num_samples, envelope in zip(
+        samples_list, positions, segment_lengths, envelopes
+    ):
+        if samples is None or num_samples == 0:
+            continue
+        if not (isinstance(samples, array) and samples.typecode == 'f'):
+            samples = array('f', samples)
+        # 音声が短いときは足りない部分を無音とし、開始位置が負のときは先頭を捨てる
+        available = min(len(samples), num_samples)
+        points = _envelope_points(envelope or DEFAULT_ENVELOPE, num_samples, framerate)
+        for (t_start, gain_start), (t_end, gain_end) in zip(points[:-1], points[1:]):
+            # 出力の範囲外と、音声が足りない部分は使わない
+            i_start = max(t_start, -position)
+            i_end = min(t_end, available)
+            if i_end <= i_start or (gain_start == 0 and gain_end == 0):
+                continue
+            piece = samples[i_start:i_end]
+            if gain_start != 1 or gain_end != 1:
+                gains = _ramp(gain_start, gain_end, t_end - t_start)
+                piece = array(
+                    'f', map(mul, piece, gains[i_start - t_start : i_end - t_start])
+                )
+            a = position + i_start
+            b = position + i_end
+            # 書き込み済みの部分とは足し合わせ、それより後ろはそのまま書き込む
+            c = min(max(written_until, a), b)
+            if c > a:
+                output[a:c] = array('f', map(add, output[a:c], piece[: c - a]))
+            if b > c:
+                output[c:b] = piece[c - a :]
+        written_until = max(written_until, position + available)
+    return output
+
+
+def _note_float(note, key: str, default: float) -> float:
+    """
+    ノートの値を小数で取得する。値がないか空文字のときは default を返す。
+    """
+    value = note.get(key)
+    if value is None or value == '':
+        return default
+    return float(value)
+
+
+class RenderCache:
+    """
+    リサンプラーで合成したノートの音声を、入力の値のハッシュをキーにして保存するキャッシュ。
+    1ノートだけ編集したときに、ほかのノートの合成を省略するために使う。
+    合計サイズが max_bytes を超えたら、最後に使われたのが古いものから削除する。
+
+    hits, misses: キャッシュを参照した回数のうち、見つかった回数と見つからなかった回数
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 1024**3):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # {キー: ファイルサイズ} を最後に使った時刻の古い順に並べる
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.wav'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        self._sizes = {key: size for _, key, size in sorted(entries)}
+        self.total_bytes = sum(self._sizes.values())
+        self._evict()
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @staticmethod
+    def _file_identity(path) -> list:
+        """
+        ファイルのパス・更新時刻・サイズ。ファイルでなければパスだけ。
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return [str(path)]
+        return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+    def key(self, args: list, resampler_cmd: list) -> str:
+        """
+        リサンプラーの引数 (出力ファイル名を除く) と、入力の音声ファイルおよび
+        リサンプラーの実行ファイルの更新状態から、キャッシュのキーを作る。
+        """
+        source = [
+            [self._file_identity(x) for x in resampler_cmd],
+            self._file_identity(args[0]),
+            args[2:],
+        ]
+        return hashlib.sha256(json.dumps(source).encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        キーに対応するキャッシュファイルのパス
+        """
+        return os.path.join(self.cache_dir, f'{key}.wav')
+
+    def get(self, key: str):
+        """
+        キャッシュファイルのパスを返す。無いときは None を返す。
+        """
+        path = self.path(key)
+        if key not in self._sizes or not os.path.isfile(path):
+            self._sizes.pop(key, None)
+            self.misses += 1
+            return None
+        # 最後に使った時刻を更新する
+        os.utime(path)
+        self._sizes[key] = self._sizes.pop(key)
+        self.hits += 1
+        return path
+
+    def put(self, key: str, path_wav) -> str:
+        """
+        合成した音声ファイルをキャッシュに登録し、キャッシュファイルのパスを返す。
+        """
+        path = self.path(key)
+        path_temp = f'{path}.tmp'
+        shutil.copyfile(path_wav, path_temp)
+        os.replace(path_temp, path)
+        size = os.path.getsize(path)
+        self.total_bytes += size - self._sizes.pop(key, 0)
+        self._sizes[key] = size
+        self._evict()
+        return path
+
+    def _evict(self):
+        """
+        合計サイズが上限以下になるまで、古いものから削除する。
+        """
+        while self.total_bytes > self.max_bytes and len(self._sizes) > 1:
+            key = next(iter(self._sizes))
+            self.total_bytes -= self._sizes.pop(key)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        すべてのキャッシュファイルを削除する。
+        """
+        for key in list(self._sizes):
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+        self._sizes.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        監視用の集計値
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self),
+            'total_bytes': self.total_bytes,
+        }
+
+
+class Renderer:
+    """
+    UST と UTAU音源から、外部のリサンプラーを使って歌声を合成するクラス。
+    UTAUの temp.bat のようにノートを1つずつ順番に処理するのではなく、
+    ノートごとのリサンプラーを複数同時に実行し、結果を wavtool() でつなげる。
+
+    resampler_cmd: リサンプラーの実行ファイルのパス。
+                   ['python', 'resampler.py'] のようにリストで引数を追加できる。
+    workers      : 同時に実行するリサンプラーの数
+    cache        : RenderCache オブジェクト。指定したときは入力が同じノートの合成を省略する。
+    """
+
+    def __init__(
+        self,
+        ust,
+        voicebank,
+        resampler_cmd,
+        workers=None,
+        temp_dir=None,
+        framerate=44100,
+        cache=None,
+    ):
+        self.ust = ust
+        self.voicebank = voicebank
+        if isinstance(resampler_cmd, str):
+            resampler_cmd = [resampler_cmd]
+        self.resampler_cmd = list(resampler_cmd)
+        self.workers = workers
+        self.temp_dir = temp_dir
+        self.framerate = framerate
+        self.cache = cache
+
+    def _note_params(self) -> list:
+        """
+        ノートごとの合成用の値を辞書のリストにする。休符は None になる。
+        前後のノートの値を参照するため、全ノートをまとめて計算する。
+        """
+        notes = self.ust.notes
+        otos = self.voicebank.resolve_aliases(self.ust)
+        params = []
+        for note, oto in zip(notes, otos):
+            if oto is None:
+                if note.lyric != 'R':
+                    logging.warning(
+                        '原音設定が見つからないため休符として扱います : %s', note.lyric
+                    )
+                params.append(None)
+                continue
+            params.append(
+                {
+                    'oto': oto,
+                    'preutterance': _note_float(note, 'PreUtterance', oto.preutterance),
+                    'overlap': _note_float(note, 'VoiceOverlap', oto.overlap),
+                    'start_point': _note_float(note, 'StartPoint', 0),
+                }
+            )
+        return params
+
+    def resampler_args(self, params=None) -> list:
+        """
+        ノートごとのリサンプラーの引数 (出力ファイル名を除く) を返す。休符は None になる。
+        引数の順番は UTAU と同じく
+        入力ファイル 出力ファイル 音高 子音速度 フラグ オフセット 長さ 子音部 右ブランク
+        音量 モジュレーション !テンポ ピッチ文字列
+        で、出力ファイルの位置には None が入る。
+        """
+        notes = self.ust.notes
+        if params is None:
+            params = self._note_params()
+        next_params = [*params[1:], None]
+        result = []
+        # ピッチ文字列は最後にまとめて作る
+        curves = []
+        for note, param, next_param in zip(notes, params, next_params):
+            if param is None:
+                result.append(None)
+                continue
+            oto = param['oto']
+            # 次のノートの先行発声の位置にオーバーラップを加えた時刻まで出力させる
+            length_ms = note.length_ms + param['preutterance'] + param['start_point']
+            if next_param is not None:
+                length_ms += next_param['overlap'] - next_param['preutterance']
+            # UTAUと同じく50ms単位で切り上げる
+            length_ms = max(math.ceil(length_ms / 50) * 50, 50)
+            # ピッチ曲線は出力する音声の先頭から PITCH_INTERVAL_TICKS ごとに求める
+            tempo = note.tempo
+            interval_ms = PITCH_INTERVAL_TICKS * 125 / tempo
+            num_points = math.ceil(length_ms / interval_ms) + 1
+            t_origin = -param['preutterance'] - param['start_point']
+            times_ms = [t_origin + k * interval_ms for k in range(num_points)]
+            notenum = note.notenum
+            modulation = note.get('Modulation', note.get('Moduration', 0))
+            result.append(
+                [
+                    self.voicebank.path_wav(oto.alias),
+                    None,
+                    f'{NOTENAMES[notenum % 12]}{notenum // 12 - 1}',
+                    str(note.velocity),
+                    note.flags,
+                    str(oto.offset),
+                    str(length_ms),
+                    str(oto.consonant),
+                    str(oto.cutoff),
+                    str(note.intensity),
+                    str(modulation or 0),
+                    f'!{tempo:g}',
+                    None,
+                ]
+            )
+            curves.append(_pitch.mode2_curve(note, times_ms))
+        args_list = [args for args in result if args is not None]
+        for args, pitch_string in zip(args_list, _pitch.encode_many(curves)):
+            args[-1] = pitch_string
+        return result
+
+    def _run_resampler(self, args: list):
+        """
+        リサンプラーを1回実行する。失敗したときは例外を送出する。
+        """
+        subprocess.run([*self.resampler_cmd, *args], check=True, capture_output=True)
+
+    def _read_rendered(self, path) -> array:
+        """
+        リサンプラーが出力した音声を読み取る。
+        サンプリング周波数が出力と異なると速さが変わってしまうので、そのときは例外を送出する。
+        """
+        samples, framerate = read_wav(path)
+        if framerate != self.framerate:
+            raise ValueError(
+                f'Sampling rate of the resampler output ({framerate} Hz) does not match'
+                f' the output ({self.framerate} Hz): {path}'
+            )
+        return samples
+
+    def render_notes(self, temp_dir, params=None) -> list:
+        """
+        すべてのノートをリサンプラーで合成し、ノートごとの音声のリストを返す。
+        StartPoint の分は先頭から取り除く。休符は None になる。
+        """
+        if params is None:
+            params = self._note_params()
+        all_args = self.resampler_args(params)
+        cache = self.cache
+        # ノート番号 → 音声の配列
+        # キャッシュファイルは後の put() で削除されうるので、見つかった時点で読み込む
+        rendered = {}
+        # キャッシュに無いノートの (ノート番号, 引数, キー)
+        jobs = []
+        # 同じ入力のノートは1回だけ合成する {キー: 合成するノートの番号}
+        pending = {}
+        duplicates = []
+        for i, args in enumerate(all_args):
+            if args is None:
+                continue
+            key = None
+            if cache is not None:
+                key = cache.key(args, self.resampler_cmd)
+                if key in pending:
+                    duplicates.append((i, pending[key]))
+                    continue
+                path_cached = cache.get(key)
+                if path_cached is not None:
+                    rendered[i] = self._read_rendered(path_cached)
+                    continue
+                pending[key] = i
+            args[1] = os.path.join(temp_dir, f'{i:05d}.wav')
+            jobs.append((i, args, key))
+        # リサンプラーは別プロセスで動くので、スレッドから起動すれば並列に実行される
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._run_resampler, args) for _, args, _ in jobs]
+            for future in futures:
+                future.result()
+        for i, args, key in jobs:
+            rendered[i] = self._read_rendered(args[1])
+            if cache is not None:
+                cache.put(key, args[1])
+        for i, i_rendered in duplicates:
+            rendered[i] = rendered[i_rendered]
+        samples_list = [None] * len(all_args)
+        for i, samples in rendered.items():
+            skip = round(params[i]['start_point'] * self.framerate / 1000)
+            samples_list[i] = samples[skip:]
+        return samples_list
+
+    def render(self, path_out=None) -> array:
+        """
+        歌声を合成して float32 の配列で返す。path_out を指定したときはWAVファイルも出力する。
+        """
+        notes = self.ust.notes
+        params = self._note_params()
+        temp_dir = self.temp_dir
+        if temp_dir is None:
+            temp_dir = tempfile.mkdtemp(prefix='utaupy_render_')
+        try:
+            samples_list = self.render_notes(temp_dir, params)
+        finally:
+            if self.temp_dir is None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        output = wavtool(
+            samples_list,
+            [note.length_ms for note in notes],
+            [0 if p is None else p['preutterance'] for p in params],
+            [0 if p is None else p['overlap'] for p in params],
+            [note.envelope for note in notes],
+            framerate=self.framerate,
+        )
+        if path_out is not None:
+            write_wav(path_out, output, self.framerate)
+        return output
+
+
+if __name__ == '__main__':
+    print('このモジュールは直接実行できません。')
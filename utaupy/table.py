@@ -3,6 +3,17 @@
 日本語とアルファベットの対応表を扱うモジュールです。
 """
 
+import hashlib
+import json
+import logging
+import os
+from functools import lru_cache
+
+# テーブルのキャッシュファイルの形式のバージョン
+TABLE_CACHE_VERSION = 1
+# トライ木で、そこまでの文字列に対応する音素を登録するキー
+_TRIE_END = None
+
 
 def main():
     """呼び出されても特に何もしない"""
@@ -21,49 +32,279 @@ def load(path, encoding='utf-8') -> dict:
 
 def load_table_file(path_table, encoding='utf-8') -> dict:
     """テーブルを読み取ってインスタンス生成"""
-    # ファイル読み取り
-    try:
-        with open(path_table, encoding=encoding) as f:
-            lines = [line.strip() for line in f.readlines()]
-    except UnicodeDecodeError:
+    return load_compiled(path_table, encoding=encoding, kind='table').copy_data()
+
+
+def load_conf_file(path_conf, encoding='utf-8') -> dict:
+    """音素分類用のファイルを読み取って辞書を返す"""
+    return load_compiled(path_conf, encoding=encoding, kind='conf').copy_data()
+
+
+def _read_lines(path, encoding='utf-8') -> list:
+    """
+    ファイルを1回だけ読み、encoding, cp932, utf-8 の順に文字列への変換を試す。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    for codec in (encoding, 'cp932'):
         try:
-            with open(path_table, encoding='cp932') as f:
-                lines = [line.strip() for line in f.readlines()]
+            text = data.decode(codec)
+            break
         except UnicodeDecodeError:
-            with open(path_table, encoding='utf-8') as f:
-                lines = [line.strip() for line in f.readlines()]
-    # 辞書にする
+            pass
+    else:
+        text = data.decode('utf-8')
+    return [line.strip() for line in text.splitlines()]
+
+
+def _parse_table(lines: list) -> dict:
+    """
+    テーブルファイルの各行を {見出し: [音素, ...]} の辞書にする。
+    """
     d_table = {}
     for line in lines:
         line_split = line.split()
-        d_table[line_split[0]] = line_split[1:]
+        if line_split:
+            d_table[line_split[0]] = line_split[1:]
     return d_table
 
 
-def load_conf_file(path_conf, encoding='utf-8') -> dict:
-    """音素分類用のファイルを読み取って辞書を返す"""
-    # ファイル読み取り
-    try:
-        with open(path_conf, encoding=encoding) as f:
-            lines = [line.strip() for line in f.readlines()]
-    except UnicodeDecodeError:
-        try:
-            with open(path_conf, encoding='cp932') as f:
-                lines = [line.strip() for line in f.readlines()]
-        except UnicodeDecodeError:
-            with open(path_conf, mencoding='utf-8') as f:
-                lines = [line.strip() for line in f.readlines()]
-    # 辞書にする
+def _parse_conf(lines: list) -> dict:
+    """
+    音素分類用のファイルの各行を {分類: [音素, ...]} の辞書にする。
+    """
     d_conf = {'SILENCES': ['sil'], 'PAUSES': ['pau'], 'BREAKS': ['br']}
     for line in lines:
+        if '=' not in line:
+            continue
         key, value = line.split('=', 1)
         phonemes = value.strip('"').split(',')
         d_conf[key] = phonemes
     if 'PHONEME_CL' in d_conf:
         d_conf['BREAKS'] += d_conf['PHONEME_CL']
-
     return d_conf
 
 
+# {(ファイルのパス, 文字コード, 種類): CompiledTable}
+_COMPILED_TABLES = {}
+
+
+def load_compiled(path, encoding='utf-8', cache_dir=None, kind=None) -> 'CompiledTable':
+    """
+    テーブルファイル (.table) または音素分類用のファイル (.conf) を読み取って
+    CompiledTable を返す。
+    kind: 'table' または 'conf'。省略したときは拡張子で判定する。
+    同じファイルを何度も読み取るときは、ファイルの更新日時とサイズが変わっていなければ
+    前回の結果を使う。cache_dir を指定すると、解析結果をJSONファイルとして保存し、
+    別のプロセスでも再利用する。
+    """
+    path = os.path.abspath(str(path).strip('\'"'))
+    if kind is None:
+        if path.endswith('.table'):
+            kind = 'table'
+        elif path.endswith('.conf'):
+            kind = 'conf'
+        else:
+            raise ValueError(f'Input path must end with ".table" or ".conf".: {path}')
+    elif kind not in ('table', 'conf'):
+        raise ValueError(f'kind must be "table" or "conf".: {kind}')
+    stat = os.stat(path)
+    key = (path, encoding, kind)
+    path_cache = None
+    if cache_dir is not None:
+        name = hashlib.sha256(f'{path}\n{encoding}\n{kind}'.encode('utf-8')).hexdigest()
+        path_cache = os.path.join(str(cache_dir), f'{name}.json')
+    compiled = _COMPILED_TABLES.get(key)
+    if compiled is not None and compiled.is_valid(stat):
+        if path_cache is not None and not os.path.exists(path_cache):
+            compiled.write_cache(path_cache)
+        return compiled
+    compiled = None
+    if path_cache is not None:
+        compiled = CompiledTable.read_cache(path_cache, stat)
+    if compiled is None:
+        lines = _read_lines(path, encoding=encoding)
+        data = _parse_table(lines) if kind == 'table' else _parse_conf(lines)
+        compiled = CompiledTable(path, data, stat.st_mtime_ns, stat.st_size)
+        if path_cache is not None:
+            compiled.write_cache(path_cache)
+    _COMPILED_TABLES[key] = compiled
+    return compiled
+
+
+class CompiledTable:
+    """
+    解析済みのテーブルファイルまたは音素分類用のファイル。
+    テーブルファイルのときは converter で LyricConverter を、
+    音素分類用のファイルのときは vowels などで音素の frozenset を取得できる。
+    """
+
+    def __init__(self, path: str, data: dict, mtime_ns: int, size: int):
+        self.path = path
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._converter = None
+        # 音素分類用のファイルのときだけ値が入る
+        self.vowels = frozenset(data.get('VOWELS', ()))
+        self.pauses = frozenset(data.get('PAUSES', ()))
+        self.silences = frozenset(data.get('SILENCES', ()))
+        self.breaks = frozenset(data.get('BREAKS', ()))
+
+    @property
+    def converter(self) -> 'LyricConverter':
+        """
+        テーブルから作った LyricConverter。初めて参照したときに作る。
+        """
+        if self._converter is None:
+            self._converter = LyricConverter(self.data)
+        return self._converter
+
+    def is_valid(self, stat) -> bool:
+        """
+        ファイルが解析したときから更新されていないかどうか
+        """
+        return self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+
+    def copy_data(self) -> dict:
+        """
+        呼び出し側で書き換えても影響がないように、辞書と各リストを複製して返す。
+        """
+        return {key: list(value) for key, value in self.data.items()}
+
+    @classmethod
+    def read_cache(cls, path_cache, stat):
+        """
+        キャッシュファイルを読み取る。無いときや古いときは None を返す。
+        """
+        try:
+            with open(path_cache, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get('version') != TABLE_CACHE_VERSION:
+            return None
+        if [cache.get('mtime_ns'), cache.get('size')] != [stat.st_mtime_ns, stat.st_size]:
+            return None
+        return cls(cache['path'], cache['data'], cache['mtime_ns'], cache['size'])
+
+    def write_cache(self, path_cache):
+        """
+        キャッシュファイルを出力する。書き込めなかったときは警告のみ。
+        """
+        cache = {
+            'version': TABLE_CACHE_VERSION,
+            'path': self.path,
+            'mtime_ns': self.mtime_ns,
+            'size': self.size,
+            'data': self.data,
+        }
+        try:
+            os.makedirs(os.path.dirname(path_cache), exist_ok=True)
+            with open(path_cache, mode='w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+        except OSError as e:
+            logging.warning('テーブルのキャッシュファイルを出力できませんでした : %s', e)
+
+
+def as_converter(d_table) -> 'LyricConverter':
+    """
+    テーブルの辞書を LyricConverter にする。すでに LyricConverter ならそのまま返し、
+    CompiledTable ならその converter を返す。
+    """
+    if isinstance(d_table, LyricConverter):
+        return d_table
+    if isinstance(d_table, CompiledTable):
+        return d_table.converter
+    return LyricConverter(d_table)
+
+
+class LyricConverter:
+    """
+    load() で読み取ったテーブルを使って、歌詞を音素に変換するクラス。
+    歌詞全体がテーブルにあればその音素を使い、無ければ空白で区切ってから
+    テーブルの見出しと最も長く一致する部分ずつ変換する。
+    「きゃっと」は「きゃ」「っ」「と」、「a か」は「a」「か」に分けて変換する。
+    テーブルに無い文字が続く部分は、その文字列をそのまま1つの音素とする。
+    同じ歌詞の変換結果は maxsize 個まで保持する。
+    """
+
+    def __init__(self, d_table: dict, maxsize: int = 4096):
+        self.d_table = d_table
+        # 見出しの文字を1文字ずつたどるトライ木
+        trie = {}
+        for key, phonemes in d_table.items():
+            node = trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[_TRIE_END] = tuple(phonemes)
+        self._trie = trie
+        self._convert_cached = lru_cache(maxsize=maxsize)(self._convert)
+
+    def __call__(self, lyric: str) -> list:
+        return self.convert(lyric)
+
+    def convert(self, lyric: str) -> list:
+        """
+        歌詞を音素のリストに変換する。
+        """
+        return list(self._convert_cached(lyric))
+
+    def _convert(self, lyric: str) -> tuple:
+        """
+        歌詞を音素のタプルに変換する。
+        """
+        d_table = self.d_table
+        if lyric in d_table:
+            return tuple(d_table[lyric])
+        phonemes = []
+        for word in lyric.split():
+            if word in d_table:
+                phonemes += d_table[word]
+            else:
+                phonemes += self._segment(word)
+        return tuple(phonemes)
+
+    def _segment(self, word: str) -> list:
+        """
+        最長一致で見出しごとに区切って音素に変換する。
+        """
+        trie = self._trie
+        phonemes = []
+        # テーブルに無い文字が続いている部分の開始位置
+        unknown_start = None
+        i = 0
+        while i < len(word):
+            node = trie
+            match_end = None
+            match_phonemes = None
+            j = i
+            while j < len(word) and word[j] in node:
+                node = node[word[j]]
+                j += 1
+                if _TRIE_END in node:
+                    match_end = j
+                    match_phonemes = node[_TRIE_END]
+            if match_end is None:
+                if unknown_start is None:
+                    unknown_start = i
+                i += 1
+                continue
+            if unknown_start is not None:
+                phonemes.append(word[unknown_start:i])
+                unknown_start = None
+            phonemes += match_phonemes
+            i = match_end
+        if unknown_start is not None:
+            phonemes.append(word[unknown_start:])
+        return phonemes
+
+    def cache_info(self):
+        """
+        変換結果の保持状況 (functools.lru_cache の cache_info())
+        """
+        return self._convert_cached.cache_info()
+
+
 if __name__ == '__main__':
     main()
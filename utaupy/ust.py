@@ -679,11 +679,11 @@ class Ust:
         current_value = self.setting.get(key, first_local_value)
         # 不要なデータを削除
         for note in self.notes:
-            if key in note:
-                if note[key] == current_value:
-                    del note[key]
-            else:
-                current_value = note.get(key, note._hidden_dict[key])
+            value = note.get(key, note._hidden_dict[key])
+            if key in note and value == current_value:
+                del note[key]
+            # 値が変化したノートのあとは、その値と比べる
+            current_value = value
 
     def reload_local_value(self, key: str):
         """
@@ -1171,6 +1171,47 @@ class Note(UserDict):
     def vibrato(self, value: Optional[Union[list[int], list[float]]]):
         self.vbr = value
 
+    @property
+    def envelope(self) -> Optional[list[float]]:
+        """
+        ノートのエンベロープ
+
+        ## 例
+        Envelope=0,5,35,0,100,100,0,%,0,10,100
+        ## 詳細
+            p1,p2,p3,v1,v2,v3,v4,%,p4,p5,v5
+            - p1, p2, p5 : 前から順に、直前の点からの時刻[ms]
+            - p3, p4     : 後ろから順に、直後の点からの時刻[ms]
+            - v1 ~ v5    : 各点の音量[%]
+            '%' 以降は省略されることがある。
+        返り値は [p1, p2, p3, v1, v2, v3, v4, p4, p5, v5] のリスト。
+        省略された値は p4=0, p5=0, v5=100 とする。
+        """
+        # 辞書には文字列で登録してある
+        s_envelope = self.get('Envelope')
+        # Envelopeがないとき
+        if s_envelope is None:
+            return None
+        if s_envelope == '':
+            return None
+        # 区切りの '%' を除いて数値のリストにする
+        values = [float(x or 0) for x in s_envelope.split(',') if x != '%']
+        if not 7 <= len(values) <= 10:
+            raise ValueError(f'Envelope must have 7 to 10 values.: {s_envelope}')
+        return values + [0, 0, 100][len(values) - 7 :]
+
+    @envelope.setter
+    def envelope(self, list_envelope: Optional[Union[list[int], list[float]]]):
+        if list_envelope is None:
+            return
+        if not 7 <= len(list_envelope) <= 10:
+            raise ValueError('Envelope must be a list of length 7 to 10.')
+        str_values = list(map(str, list_envelope))
+        # p4 以降があるときは '%' で区切る
+        if len(str_values) > 7:
+            str_values.insert(7, '%')
+        self['Envelope'] = ','.join(str_values)
+
     # ここからノート操作系-----------------------------------------------------
 
     def delete(self):
@@ -4,12 +4,22 @@
 UTAU音源を扱うモジュール
 """
 
+import hashlib
+import json
+import logging
+import os
 import platform
-from collections import UserDict
+from collections import OrderedDict, UserDict
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from os.path import dirname, expandvars
+from os.path import abspath, dirname, expanduser, expandvars, join, splitext
 
+from . import frq as _frq
 from . import otoini as _otoini
+from . import ust as _ust
+
+# 原音設定のキャッシュファイルの形式のバージョン
+OTOINI_CACHE_VERSION = 2
 
 # Windowsのとき
 if str(platform.system()) == 'Windows':
@@ -63,127 +73,100 @@ def utau_appdata_root() -> str:
     return expandvars(r'%APPDATA%\UTAU')
 
 
+def user_cache_dir() -> str:
+    r"""
+    utaupy のキャッシュファイルを置くユーザーごとのフォルダのパスを返す。
+    Windows では %LOCALAPPDATA%\utaupy、それ以外では $XDG_CACHE_HOME/utaupy か ~/.cache/utaupy。
+    """
+    if str(platform.system()) == 'Windows':
+        root = os.environ.get('LOCALAPPDATA') or expanduser('~')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache')
+    return join(root, 'utaupy')
+
+
 class PrefixMap(UserDict):
     """
     UTAUの多音階音源用の prefixmap ファイルを扱うクラス。
-    prefixmap_obj[音階名] または prefixmap_obj[音階番号] で
-    サフィックス文字列を取得できるようにしたい。
+    prefixmap_obj[音階番号の文字列] でサフィックス文字列を取得できる。
+    音階名は C#4 と Db4 のどちらの表記にも対応する。
     """
 
-    def __init__(self, path):
+    def __init__(self, path=None):
         super().__init__()
         self.comment_lines = []
+        # prefix.map が無い音源ではサフィックスなしとして扱う
+        if path is None:
+            return
         with open(path, encoding='cp932') as prefixmap_file:
             lines = prefixmap_file.readlines()
         # 改行文字を削除、コメント行を無視
         lines = [line.rstrip('\r\n') for line in lines if not line.startswith('//')]
         # 空白で区切って {音程: suffix文字列} の辞書にする
-        lines_2d = [line.split(maxsplit=1) for line in lines]
+        lines_2d = [line.split(maxsplit=1) for line in lines if line.strip()]
         # 音程表記をUSTでの音階番号に変換
-        abc_to_notenum = {
-            'C1': '24',
-            'C#1': '25',
-            'D1': '26',
-            'D#1': '27',
-            'E1': '28',
-            'F1': '29',
-            'F#1': '30',
-            'G1': '31',
-            'G#1': '32',
-            'A1': '33',
-            'A#1': '34',
-            'B1': '35',
-            'C2': '36',
-            'C#2': '37',
-            'D2': '38',
-            'D#2': '39',
-            'E2': '40',
-            'F2': '41',
-            'F#2': '42',
-            'G2': '43',
-            'G#2': '44',
-            'A2': '45',
-            'A#2': '46',
-            'B2': '47',
-            'C3': '48',
-            'C#3': '49',
-            'D3': '50',
-            'D#3': '51',
-            'E3': '52',
-            'F3': '53',
-            'F#3': '54',
-            'G3': '55',
-            'G#3': '56',
-            'A3': '57',
-            'A#3': '58',
-            'B3': '59',
-            'C4': '60',
-            'C#4': '61',
-            'D4': '62',
-            'D#4': '63',
-            'E4': '64',
-            'F4': '65',
-            'F#4': '66',
-            'G4': '67',
-            'G#4': '68',
-            'A4': '69',
-            'A#4': '70',
-            'B4': '71',
-            'C5': '72',
-            'C#5': '73',
-            'D5': '74',
-            'D#5': '75',
-            'E5': '76',
-            'F5': '77',
-            'F#5': '78',
-            'G5': '79',
-            'G#5': '80',
-            'A5': '81',
-            'A#5': '82',
-            'B5': '83',
-            'C6': '84',
-            'C#6': '85',
-            'D6': '86',
-            'D#6': '87',
-            'E6': '88',
-            'F6': '89',
-            'F#6': '90',
-            'G6': '91',
-            'G#6': '92',
-            'A6': '93',
-            'A#6': '94',
-            'B6': '95',
-            'C7': '96',
-            'C#7': '97',
-            'D7': '98',
-            'D#7': '99',
-            'E7': '100',
-            'F7': '101',
-            'F#7': '102',
-            'G7': '103',
-            'G#7': '104',
-            'A7': '105',
-            'A#7': '106',
-            'B7': '107',
-            'C8': '108',
-            'C#8': '109',
-            'D8': '110',
-            'D#8': '111',
-            'E8': '112',
-            'F8': '113',
-            'F#8': '114',
-            'G8': '115',
-            'G#8': '116',
-            'A8': '117',
-            'A#8': '118',
-            'B8': '119',
-        }
+        notename_to_notenum = _ust.NOTENAME_TO_NOTENUM_DICT
         # {音階番号: suffix文字列} の辞書になる
         for line in lines_2d:
+            notenum = str(notename_to_notenum[line[0]])
             if len(line) == 1:
-                self.data.update({abc_to_notenum[line[0]]: ''})
+                self.data.update({notenum: ''})
             else:
-                self.data.update({abc_to_notenum[line[0]]: line[1]})
+                self.data.update({notenum: line[1]})
+
+    def suffix(self, notenum) -> str:
+        """
+        音階番号に対応するサフィックスを返す。指定がなければ空文字列。
+        """
+        return self.data.get(str(notenum), '')
+
+
+def _otoini_to_rows(otoini) -> dict:
+    """
+    キャッシュ用に OtoIni を値のリストのリストにする。
+    書き出すときに変更の有無を判定できるように、コメントと元の行も含める。
+    """
+    rows = [
+        [
+            oto.filename,
+            oto.alias,
+            oto.offset,
+            oto.consonant,
+            oto.cutoff,
+            oto.preutterance,
+            oto.overlap,
+            oto.comment,
+            oto._source_line,  # noqa: SLF001
+        ]
+        for oto in otoini
+    ]
+    return {'rows': rows, 'malformed_lines': otoini.malformed_lines}
+
+
+def _rows_to_otoini(cached: dict):
+    """
+    キャッシュから読み取った値のリストのリストを OtoIni にする。
+    """
+    otoini = _otoini.OtoIni()
+    otoini.malformed_lines = [tuple(x) for x in cached['malformed_lines']]
+    for row in cached['rows']:
+        oto = _otoini.Oto()
+        params = tuple(row[:8])
+        (
+            oto.filename,
+            oto.alias,
+            oto.offset,
+            oto.consonant,
+            oto.cutoff,
+            oto.preutterance,
+            oto.overlap,
+            oto.comment,
+        ) = params
+        oto._source_line = row[8]  # noqa: SLF001
+        if oto._source_line is not None:  # noqa: SLF001
+            oto._source_values = params  # noqa: SLF001
+        otoini.append(oto)
+    return otoini
 
 
 class UtauVoiceBank:
@@ -192,15 +175,140 @@ class UtauVoiceBank:
     音階と歌詞（連続音）を指定したら、原音設定を返すようにしたい。
     """
 
-    def __init__(self, path):
+    def __init__(
+        self, path, max_workers=None, use_cache=True, path_cache=None, frq_cache_size=256
+    ):
+        """
+        path          : UTAU音源のフォルダのパス
+        max_workers   : oto.ini を並列に読み取るときのスレッド数
+        use_cache     : 原音設定のキャッシュファイルを使うかどうか
+        path_cache    : キャッシュファイルのパス。省略時は user_cache_dir() 内に
+                        音源フォルダのパスごとのファイルを作る。
+                        配布される音源フォルダにはキャッシュファイルを書き込まない。
+        frq_cache_size: frq() で読み取った周波数表を保持する数
+        """
         super().__init__()
         self.path = path
-        self.prefixmap = PrefixMap(f'{self.path}/prefix.map')
-        self.otoini = _otoini.OtoIni()
+        path_prefixmap = join(path, 'prefix.map')
+        self.prefixmap = PrefixMap(path_prefixmap if os.path.isfile(path_prefixmap) else None)
+        # (歌詞, サフィックス) → Oto の表。resolved_table で初めて参照したときに作る。
+        self._resolved_table = None
+        # エイリアス → oto.ini のあるフォルダ。path_wav() で初めて参照したときに作る。
+        self._alias_dirs = None
+        # 周波数表は最近使ったものだけを保持する {エイリアス: Frq}
+        self._frqs = OrderedDict()
+        self.frq_cache_size = frq_cache_size
+        if path_cache is None:
+            name = hashlib.sha256(abspath(path).encode('utf-8')).hexdigest()
+            path_cache = join(user_cache_dir(), f'otoini_{name}.json')
         # 原音設定ファイルを取得
-        all_otoini_paths = glob(f'{path}/**/oto.ini', recursive=True)
-        for path_otoini in all_otoini_paths:
-            self.otoini.data += _otoini.load(path_otoini).data
+        all_otoini_paths = sorted(glob(f'{path}/**/oto.ini', recursive=True))
+        # oto.ini ごとの原音設定 {oto.iniのパス: OtoIni}
+        self.otoinis = None
+        if use_cache:
+            self.otoinis = self._load_cache(path_cache, all_otoini_paths)
+        if self.otoinis is None:
+            # 音階ごとのフォルダにある oto.ini を並列に読み取る
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                self.otoinis = dict(
+                    zip(all_otoini_paths, executor.map(_otoini.load, all_otoini_paths))
+                )
+            if use_cache:
+                self._write_cache(path_cache, all_otoini_paths)
+        # すべての原音設定をまとめる
+        self.otoini = _otoini.OtoIni()
+        for otoini in self.otoinis.values():
+            self.otoini.extend(otoini)
+
+    @staticmethod
+    def _cache_key(otoini_paths: list) -> list:
+        """
+        キャッシュが有効か判定するための、oto.ini のパス・更新時刻・サイズのリスト
+        """
+        key = []
+        for path_otoini in otoini_paths:
+            stat = os.stat(path_otoini)
+            key.append([path_otoini, stat.st_mtime_ns, stat.st_size])
+        return key
+
+    def _load_cache(self, path_cache, otoini_paths: list):
+        """
+        キャッシュファイルを読み取る。
+        oto.ini が更新されていたり、読み取りに失敗したりしたときは None を返す。
+        """
+        try:
+            with open(path_cache, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get('version') != OTOINI_CACHE_VERSION:
+            return None
+        if cache.get('key') != self._cache_key(otoini_paths):
+            return None
+        return {
+            path_otoini: _rows_to_otoini(cached)
+            for path_otoini, cached in zip(otoini_paths, cache['otoinis'])
+        }
+
+    def _write_cache(self, path_cache, otoini_paths: list):
+        """
+        キャッシュファイルを出力する。書き込めなかったときは警告のみ。
+        """
+        cache = {
+            'version': OTOINI_CACHE_VERSION,
+            'key': self._cache_key(otoini_paths),
+            'otoinis': [_otoini_to_rows(self.otoinis[p]) for p in otoini_paths],
+        }
+        try:
+            os.makedirs(dirname(abspath(path_cache)), exist_ok=True)
+            with open(path_cache, mode='w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+        except OSError as e:
+            logging.warning('原音設定のキャッシュファイルを出力できませんでした : %s', e)
+
+    def _build_alias_dirs(self):
+        """
+        エイリアス → oto.ini のあるフォルダ の辞書を作る。
+        """
+        alias_dirs = {}
+        for path_otoini, otoini in self.otoinis.items():
+            for oto in otoini:
+                alias_dirs.setdefault(oto.alias, dirname(path_otoini))
+        self._alias_dirs = alias_dirs
+
+    def path_wav(self, alias: str) -> str:
+        """
+        エイリアスに対応する音声ファイルのパスを返す。
+        音声ファイルは、そのエイリアスが書かれている oto.ini と同じフォルダにある。
+        """
+        if self._alias_dirs is None:
+            self._build_alias_dirs()
+        oto = self.otoini.get(alias)
+        if oto is None:
+            raise KeyError(alias)
+        # 読み込んだ後に追加・変更されたエイリアスのときは作りなおす
+        if alias not in self._alias_dirs:
+            self._build_alias_dirs()
+        if alias not in self._alias_dirs:
+            raise KeyError(
+                f'Alias is not in any oto.ini of this voicebank (otoinis): {alias}'
+            )
+        return join(self._alias_dirs[alias], oto.filename)
+
+    def frq(self, alias: str) -> _frq.Frq:
+        """
+        エイリアスに対応する周波数表ファイル (*_wav.frq) を読み取る。
+        結果はエイリアスごとに保持し、閉じられていたときは読み直す。
+        保持する数を超えたときは、最後に使ったのが古いものから閉じる。
+        """
+        frq = self._frqs.pop(alias, None)
+        if frq is None or frq.closed:
+            frq = _frq.load(f'{splitext(self.path_wav(alias))[0]}_wav.frq')
+        self._frqs[alias] = frq
+        while len(self._frqs) > self.frq_cache_size:
+            _, frq_evicted = self._frqs.popitem(last=False)
+            frq_evicted.close()
+        return frq
 
     def autoselect_alias(self, utaupy_ust_note):
         """
@@ -223,7 +331,7 @@ class UtauVoiceBank:
             return lyric.lstrip('?')
         # 普通の歌詞の場合はprefixmapを参照してサフィックス追加
         # TODO: すでにサフィックスがある場合に不具合を回避する必要がある
-        return lyric + self.prefixmap[str(utaupy_ust_note.notenum)]
+        return lyric + self.prefixmap.suffix(utaupy_ust_note.notenum)
 
     def get_oto(self, utaupy_ust_note, suffix_exists=False):
         """
@@ -237,15 +345,75 @@ class UtauVoiceBank:
         """
         if suffix_exists is False:
             alias = self.autoselect_alias(utaupy_ust_note)
+        else:
+            alias = utaupy_ust_note.lyric
         # 原音にちゃんとあるかどうか
-        if alias in self.otoini:
-            oto_for_the_alias = self.otoini[alias]
+        oto_for_the_alias = self.otoini.get(alias)
         # なければ全部の数値がゼロの原音設定値を返す
-        else:
+        if oto_for_the_alias is None:
             oto_for_the_alias = _otoini.Oto()
             oto_for_the_alias.alias = alias
         return oto_for_the_alias
 
+    @property
+    def resolved_table(self) -> dict:
+        """
+        {(歌詞, サフィックス): Oto} の辞書。
+        prefix.map にあるサフィックスごとに、そのサフィックスで終わるエイリアスを登録する。
+        サフィックスで引くことで、音階の数だけ同じ Oto を登録せずに済む。
+        原音設定を編集したときは reindex() を実行すること。
+        """
+        if self._resolved_table is None:
+            suffixes = set(self.prefixmap.values())
+            suffixes.add('')
+            table = {}
+            for alias, oto in self.otoini.alias_index.items():
+                for suffix in suffixes:
+                    if alias.endswith(suffix):
+                        lyric = alias[: len(alias) - len(suffix)]
+                        table[(lyric, suffix)] = oto
+            self._resolved_table = table
+        return self._resolved_table
+
+    def reindex(self):
+        """
+        原音設定の索引と resolved_table などを作りなおす。
+        """
+        self.otoini.reindex()
+        self._resolved_table = None
+        self._alias_dirs = None
+
+    def resolve_alias(self, lyric: str, notenum) -> _otoini.Oto:
+        """
+        歌詞と音階番号から、prefix.map を適用した原音設定を返す。
+        休符 'R' や、原音設定に無いエイリアスのときは None を返す。
+        歌詞が '?' で始まるときはエイリアスを強制指定したものとして扱う。
+        """
+        if lyric == 'R':
+            return None
+        if lyric.startswith('?'):
+            return self.otoini.get(lyric.lstrip('?'))
+        return self.resolved_table.get((lyric, self.prefixmap.suffix(notenum)))
+
+    def resolve_aliases(self, utaupy_ust_ust) -> list:
+        """
+        USTのすべてのノートについて、prefix.map を適用した原音設定をまとめて返す。
+        休符や原音設定に無いエイリアスのノートは None になる。
+        """
+        table = self.resolved_table
+        get_alias = self.otoini.get
+        suffix = self.prefixmap.suffix
+        result = []
+        for note in utaupy_ust_ust.notes:
+            lyric = note.lyric
+            if lyric == 'R':
+                result.append(None)
+            elif lyric.startswith('?'):
+                result.append(get_alias(lyric.lstrip('?')))
+            else:
+                result.append(table.get((lyric, suffix(note['NoteNum']))))
+        return result
+
     def autoadjust_parameters(self, utaupy_ust_ust):
         """
         voicebank       : utaupy.utau.UtauVoiceBank オブジェクト
@@ -259,24 +427,49 @@ class UtauVoiceBank:
         ・先行発声(PreUtterance)
         の4つの値を調整する。
 
-        # TODO: 子音速度100以外に対応させる。
         仕様
+        子音速度(Velocity)に応じて、原音の先行発声とオーバーラップを
+        2 ** ((100 - 子音速度) / 100) 倍する。
         前のノートが休符な時は、原音値をそのまま入力する。
         前のノートが休符でない場合
             前のノートの長さの半分が、oto.overlapからoto.preutteranceまでの長さよりも短い場合
                 差分をSTPで削る
+        各ノートの値をリストにまとめてから計算し、最後にまとめて書き込む。
         """
         notes = utaupy_ust_ust.notes
-        for i, note in enumerate(notes[1:], 1):
-            halflen = notes[i - 1].length_ms / 2
-            oto = self.get_oto(note, suffix_exists=True)
-            if halflen < oto.preutterance - oto.overlap:
-                at_preuttr = halflen * oto.preutterance / (oto.preutterance - oto.overlap)
-                at_overlap = halflen * oto.overlap / (oto.preutterance - oto.overlap)
-                note['StartPoint'] = oto.preutterance - at_preuttr
+        if len(notes) < 2:
+            return
+        lyrics = [note.lyric for note in notes]
+        # 前のノートの長さの半分と、前のノートが休符かどうか
+        halflens = [note.length_ms / 2 for note in notes[:-1]]
+        previous_is_rest = [lyric == 'R' for lyric in lyrics[:-1]]
+        # 子音速度を反映した原音の先行発声とオーバーラップ
+        get_oto = self.otoini.get
+        preutterances = []
+        overlaps = []
+        for note, lyric in zip(notes[1:], lyrics[1:]):
+            oto = get_oto(lyric)
+            if oto is None:
+                preutterances.append(0)
+                overlaps.append(0)
+            elif 'Velocity' in note:
+                velocity_ratio = 2 ** ((100 - note.velocity) / 100)
+                preutterances.append(oto.preutterance * velocity_ratio)
+                overlaps.append(oto.overlap * velocity_ratio)
+            else:
+                preutterances.append(oto.preutterance)
+                overlaps.append(oto.overlap)
+
+        for note, halflen, is_rest, preutterance, overlap in zip(
+            notes[1:], halflens, previous_is_rest, preutterances, overlaps
+        ):
+            if not is_rest and halflen < preutterance - overlap:
+                at_preuttr = halflen * preutterance / (preutterance - overlap)
+                at_overlap = halflen * overlap / (preutterance - overlap)
+                note['StartPoint'] = preutterance - at_preuttr
                 note['PreUtterance'] = at_preuttr
                 note['VoiceOverlap'] = at_overlap
             else:
                 note['StartPoint'] = 0
-                note['PreUtterance'] = oto.preutterance
-                note['VoiceOverlap'] = oto.overlap
+                note['PreUtterance'] = preutterance
+                note['VoiceOverlap'] = overlap
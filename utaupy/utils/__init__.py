@@ -2,5 +2,6 @@
 # Copyright (c) 2020-2021 oatsu
 from ._hts2json import hts2json
 from ._hts2ust import hts2ust
-from ._ust2hts import ust2hts, ustobj2songobj
+from ._ust2hts import ust2hts, ustobj2htslines, ustobj2songobj
 from ._hts2csv import hts2csv
+from ._hts2npz import hts2npz
@@ -2,40 +2,84 @@
 # Copyright (c) 2020-2021 oatsu
 """
 HTS-Full-Context-Label をCSVに変換してExcelで見るようにする。
+ラベルは1行ずつ読み取って書き込むので、長いファイルでもメモリを使いすぎない。
 """
-import re
-
-
-def hts2csv(path_in, path_out):
-    with open(path_in, mode='r', encoding='utf-8') as f:
-        lines = [line.rstrip('\n') for line in f.readlines()]
-
-    keys = []
-    keys.append('start')
-    keys.append('end')
-    keys.append(','.join([f'p{i+1}' for i in range(16)]))
-    keys.append(','.join([f'a{i+1}' for i in range(5)]))
-    keys.append(','.join([f'b{i+1}' for i in range(5)]))
-    keys.append(','.join([f'c{i+1}' for i in range(5)]))
-    keys.append(','.join([f'd{i+1}' for i in range(9)]))
-    keys.append(','.join([f'e{i+1}' for i in range(60)]))
-    keys.append(','.join([f'f{i+1}' for i in range(9)]))
-    keys.append(','.join([f'g{i+1}' for i in range(2)]))
-    keys.append(','.join([f'h{i+1}' for i in range(2)]))
-    keys.append(','.join([f'i{i+1}' for i in range(2)]))
-    keys.append(','.join([f'j{i+1}' for i in range(3)]))
-
-    l = []
-    l.append([','.join(keys)])
-
-    for line in lines:
-        line = re.sub('/.:', '@', line)
-        line = re.split(f"[{re.escape(' =+-~!@#$%^&;_|[]')}]", line)
-        l.append(line)
-    l_of_str = [','.join(v) for v in l]
-    s_out = '\n'.join(l_of_str)
-    with open(path_out, mode='w', encoding='utf-8') as f:
-        f.write(s_out)
+import codecs
+import csv
+from itertools import chain
+
+import utaupy as up
+
+# 各コンテキストの項目数
+CONTEXT_SIZES = (
+    ('p', 16),
+    ('a', 5),
+    ('b', 5),
+    ('c', 5),
+    ('d', 9),
+    ('e', 60),
+    ('f', 9),
+    ('g', 2),
+    ('h', 2),
+    ('i', 2),
+    ('j', 3),
+)
+CONTEXT_SIZE_LIST = [size for _, size in CONTEXT_SIZES]
+# CSVの見出し行
+CSV_HEADER = ['start', 'end'] + [
+    f'{group}{i + 1}' for group, size in CONTEXT_SIZES for i in range(size)
+]
+
+
+def detect_encoding(path, encoding='utf-8') -> str:
+    """
+    ファイルを encoding で読めるか先に確かめて、読めなければ 'cp932' を返す。
+    書き出し始めてから文字コードの誤りに気づかないように、変換の前に使う。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        with open(str(path).strip('"'), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return 'cp932'
+    return encoding
+
+
+def iter_rows(source, encoding='utf-8'):
+    """
+    HTSフルコンテキストラベルを1行ずつ読み取り、
+    [開始時刻, 終了時刻, p1, ..., j3] のリストを返すジェネレータ。
+    コンテキストの項目数が CONTEXT_SIZES と合わない行があれば ValueError を送出する。
+
+    source: path, lines
+    """
+    for start, end, l_contexts in up.hts.iter_contexts(source, encoding=encoding):
+        if list(map(len, l_contexts)) != CONTEXT_SIZE_LIST:
+            sizes = dict(zip((group for group, _ in CONTEXT_SIZES), map(len, l_contexts)))
+            raise ValueError(
+                f'Unexpected number of contexts at {start} {end}.: {sizes}'
+                f' (expected {dict(CONTEXT_SIZES)})'
+            )
+        yield [start, end, *chain.from_iterable(l_contexts)]
+
+
+def hts2csv(path_in, path_out, encoding='utf-8') -> int:
+    """
+    HTSフルコンテキストラベルファイルをCSVファイルに変換する。
+    値は csv.writer で書き込むので、区切り文字や引用符を含む値もクオートされる。
+    encoding で読めないファイルは cp932 として読む。
+    書き込んだ行数(見出し行を除く)を返す。
+    """
+    encoding = detect_encoding(path_in, encoding)
+    n = 0
+    with open(path_out, mode='w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(CSV_HEADER)
+        for n, row in enumerate(iter_rows(path_in, encoding=encoding), 1):
+            writer.writerow(row)
+    return n
 
 
 def main():
@@ -4,49 +4,36 @@
 HTSフルコンテキストラベルをJSONと相互変換する。
 """
 
-import re
+import json
+from io import StringIO
 
+import utaupy as up
 
-def _load_hts_lines(lines: list) -> dict:
+from ._hts2csv import detect_encoding
+
+# 1行分の辞書に登録するコンテキストの名前
+CONTEXT_KEYS = ('p', 'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j')
+
+
+def _iter_hts_dicts(source, encoding='utf-8'):
     """
-    文字列のリスト(行のリスト)をもとに値を登録する。
+    HTSフルコンテキストラベルを1行ずつ読み取り、1行分の辞書を返すジェネレータ。
+
+    source: path, lines
     """
-    # ラベル情報のリスト
-    labels = []
-    # HTSフルコンテキストラベルの各行を読み取っていく
-    for line in lines:
-        line_split = line.split(maxsplit=2)
-        # 1行分の辞書
-        d_line = {}
+    for start, end, l_contexts_2d in up.hts.iter_contexts(source, encoding=encoding):
         # 時刻の情報 [発声開始時刻, 発声終了時刻]
-        d_line['time'] = list(map(int, line_split[0:2]))
-        # コンテキスト部分を取り出す
-        str_contexts = line_split[2]
-        # コンテキスト文字列を /A: などの文字列で区切って一次元リストにする
-        l_contexts = re.split('/.:', str_contexts)
-        # 特定の文字でさらに区切って二次元リストにする
-        delimiters = re.escape('=+-~∼!@#$%^ˆ&;_|[]')
-        l_contexts_2d = [re.split((f'[{delimiters}]'), s) for s in l_contexts]
+        d_line = {'time': [start, end]}
         # 各種コンテキストを辞書に登録する
-        d_line.update(dict(
-            zip(('p', 'a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j'), l_contexts_2d)))
-        # ここからzipのもとのコード----------------------
-        # d_line['p'] = l_contexts_2d[0]
-        # d_line['a'] = l_contexts_2d[1]
-        # d_line['b'] = l_contexts_2d[2]
-        # d_line['c'] = l_contexts_2d[3]
-        # d_line['d'] = l_contexts_2d[4]
-        # d_line['e'] = l_contexts_2d[5]
-        # d_line['f'] = l_contexts_2d[6]
-        # d_line['g'] = l_contexts_2d[7]
-        # d_line['h'] = l_contexts_2d[8]
-        # d_line['i'] = l_contexts_2d[9]
-        # d_line['j'] = l_contexts_2d[10]
-        # ここまでzipのもとのコード----------------------
-
-        # ラベル情報のリストに追加
-        labels.append(d_line)
-    return {'labels': labels}
+        d_line.update(zip(CONTEXT_KEYS, l_contexts_2d))
+        yield d_line
+
+
+def _load_hts_lines(lines: list) -> dict:
+    """
+    文字列のリスト(行のリスト)をもとに値を登録する。
+    """
+    return {'labels': list(_iter_hts_dicts(lines))}
 
 
 def _load(path: str, encoding='utf-8') -> dict:
@@ -63,25 +50,50 @@ def _load(path: str, encoding='utf-8') -> dict:
     return _load_hts_lines(lines)
 
 
+def _dump_line(d_line: dict) -> str:
+    """
+    1行分の辞書を { "time": [...], "p": [...], ... } の形式のJSON文字列にする。
+    """
+    return f'{{ {json.dumps(d_line, ensure_ascii=False)[1:-1]} }}'
+
+
+def _write_flatjson(d_lines, f) -> int:
+    """
+    1行分の辞書のイテラブルを、先頭から順にJSONとしてファイルに書き込む。
+    1音素1行。書き込んだ行数を返す。
+    """
+    f.write('{\n    "labels": [')
+    n = 0
+    for n, d_line in enumerate(d_lines, 1):
+        # 2行目以降は直前の行のあとにカンマをつける
+        f.write(f'{"," if n > 1 else ""}\n        {_dump_line(d_line)}')
+    f.write('\n    ]\n}\n')
+    return n
+
+
 def _export_flatjson(d: dict, path) -> str:
     """
     JSON文字列でファイル出力する。
     1音素1行
     """
-    s = ',\n'.join([f'        {str(d_line)}' for d_line in d['labels']])
-    s = s.replace('\'', '"').replace('{', '{ ').replace('}', ' }')
-    s = '{\n    \"labels\": [\n' + s + '\n    ]\n}\n'
+    buffer = StringIO()
+    _write_flatjson(d['labels'], buffer)
+    s = buffer.getvalue()
     with open(path, mode='w', encoding='utf-8', newline='\n') as f:
         f.write(s)
     return s
 
 
-def hts2json(path_lab_in, path_json_out):
+def hts2json(path_lab_in, path_json_out, encoding='utf-8') -> int:
     """
     HTSフルコンテキストラベルファイル(.lab) を
     JSONファイル(.json) に変換する。
+    ラベルを1行ずつ読み取って書き込む。encoding で読めないファイルは cp932 として読む。
+    書き込んだ行数を返す。
     """
-    _export_flatjson(_load(path_lab_in), path_json_out)
+    encoding = detect_encoding(path_lab_in, encoding)
+    with open(path_json_out, mode='w', encoding='utf-8', newline='\n') as f:
+        return _write_flatjson(_iter_hts_dicts(path_lab_in, encoding=encoding), f)
 
 
 def main():
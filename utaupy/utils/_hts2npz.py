@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# Copyright (c) oatsu
+"""
+HTSフルコンテキストラベルを、列ごとの配列を格納した .npz ファイルに変換する。
+numpy.load(path) で読み込むと、start, end, p1, ..., j3 の列ごとに配列が得られる。
+時刻は int64、コンテキストは 'xx' を含むため固定長の文字列(<U)として格納する。
+
+numpy には依存せず、.npy 形式(version 1.0)のヘッダを直接書き込む。
+"""
+import sys
+import zipfile
+from array import array
+from itertools import repeat
+
+from ._hts2csv import CSV_HEADER, detect_encoding, iter_rows
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# numpy と同じく、ヘッダを含めたデータの先頭位置を64バイト境界にそろえる
+NPY_ALIGNMENT = 64
+
+
+def _npy_header(descr: str, length: int) -> bytes:
+    """
+    1次元配列用の .npy ヘッダを生成する。
+    """
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({length},), }}"
+    # マジック(8バイト) + ヘッダ長(2バイト) + ヘッダ + 改行 を境界にそろえる
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return NPY_MAGIC + len(header).to_bytes(2, 'little') + header
+
+
+def _write_int_column(zf, name: str, values: array):
+    """
+    整数の列を '<i8' の配列として書き込む。
+    """
+    if sys.byteorder != 'little':
+        values = array('q', values)
+        values.byteswap()
+    with zf.open(f'{name}.npy', mode='w', force_zip64=True) as f:
+        f.write(_npy_header('<i8', len(values)))
+        f.write(values.tobytes())
+
+
+def _write_str_column(zf, name: str, values: tuple):
+    """
+    文字列の列を固定長の '<U' の配列として書き込む。
+    """
+    length = len(values)
+    width = max(map(len, values), default=1) or 1
+    # 足りない分をヌル文字で埋めて、まとめて UTF-32LE にする
+    if min(map(len, values), default=width) == width:
+        padded = ''.join(values)
+    else:
+        padded = ''.join(map(str.ljust, values, repeat(width, length), repeat('\0', length)))
+    with zf.open(f'{name}.npy', mode='w', force_zip64=True) as f:
+        f.write(_npy_header(f'<U{width}', length))
+        f.write(padded.encode('utf-32-le'))
+
+
+def hts2npz(path_in, path_out, encoding='utf-8', compress: bool = False) -> int:
+    """
+    HTSフルコンテキストラベルファイルを、列ごとの配列を格納した .npz ファイルに変換する。
+    ラベルは1行ずつ読み取り、列ごとにまとめてから書き込む。
+    コンテキストの項目数が合わない行があれば ValueError を送出する。
+    encoding で読めないファイルは cp932 として読む。変換した行数を返す。
+
+    compress: True のとき numpy.savez_compressed と同じく deflate で圧縮する。
+    """
+    encoding = detect_encoding(path_in, encoding)
+    num_contexts = len(CSV_HEADER) - 2
+    starts = array('q')
+    ends = array('q')
+    rows = []
+    for row in iter_rows(path_in, encoding=encoding):
+        starts.append(row[0])
+        ends.append(row[1])
+        rows.append(row[2:])
+    # 行ごとのリストを列ごとのタプルに組み替える
+    columns = list(zip(*rows)) if rows else [()] * num_contexts
+    del rows
+
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path_out, mode='w', compression=compression, allowZip64=True) as zf:
+        _write_int_column(zf, 'start', starts)
+        _write_int_column(zf, 'end', ends)
+        for name, column in zip(CSV_HEADER[2:], columns):
+            _write_str_column(zf, name, column)
+    return len(starts)
+
+
+def main():
+    """
+    フォルダかファイルを選択して変換
+    """
+    from glob import glob
+    from os.path import isfile, join, splitext
+
+    lab_dir = input('Select a directory or a LAB file: ').strip('"')
+    lab_files = [lab_dir] if isfile(lab_dir) else glob(join(lab_dir, '*.lab'))
+
+    for path_in in lab_files:
+        path_out = f'{splitext(path_in)[0]}.npz'
+        try:
+            hts2npz(path_in, path_out)
+        except Exception as e:
+            raise Exception(f'Some exception was raised while processing {path_in}') from e
+
+
+if __name__ == '__main__':
+    main()
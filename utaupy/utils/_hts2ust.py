@@ -2,7 +2,11 @@
 # Copyright (c) 2020 oatsu
 """
 HTSフルラベルをUSTファイルに変換する。
+Songオブジェクトを経由せずに、ノートごとの e1, e4, e5, e8 と音素記号の列から
+USTのノートを1つずつ生成することもできる。(htscolumns2ustnotes)
 """
+from itertools import repeat
+
 import utaupy as up
 
 
@@ -31,6 +35,87 @@ def htsnote2ustnote(hts_note: up.hts.Note, d_table: dict = None, joint: str = '
     return ust_note
 
 
+def htscolumns2ustnotes(
+    absolute_pitches, tempos, lengths, identities, beats=None, joint: str = ' '
+):
+    """
+    ノートごとの e1, e5, e8, 音素記号のリスト から utaupy.ust.Note を1つずつ生成するジェネレータ。
+    htsnote2ustnote と同じ値を登録するが、テンポ(Tempo)と拍子情報(Label)は
+    直前のノートから変化したときだけ登録する。1ノート目には必ずテンポを登録する。
+    各引数はノート順のイテラブルで、ジェネレータも指定できる。
+
+    beats: ノートごとの e4。None のときは拍子情報を登録しない。
+    joint: 音素記号を結合するときにはさむ文字
+    """
+    # pylint: disable=too-many-arguments
+    if beats is None:
+        beats = repeat(None)
+    rows = zip(absolute_pitches, beats, tempos, lengths, identities)
+    return _rows2ustnotes(rows, joint)
+
+
+def _rows2ustnotes(rows, joint: str):
+    """
+    ノートごとの (e1, e4, e5, e8, 音素記号のリスト) から utaupy.ust.Note を1つずつ生成する。
+    e4 が None のときは拍子情報を登録しない。
+    """
+    previous_tempo = None
+    previous_beat = None
+    for absolute_pitch, beat, tempo, length, phonemes in rows:
+        ust_note = up.ust.Note()
+        # ノート長
+        ust_note.length = int(length) * 20
+        # 音高情報が無かったらC4にする。
+        ust_note.notenum = int(str(up.hts.abspitch_to_notenum(absolute_pitch)).replace('xx', '60'))
+        # テンポは変化するところだけ
+        if tempo != previous_tempo:
+            ust_note.tempo = tempo
+            previous_tempo = tempo
+        # 拍子情報は変化するところだけラベル部分に書き込む
+        if beat is not None and str(beat) != previous_beat:
+            ust_note.label = beat
+            previous_beat = str(beat)
+        # 歌詞を登録する
+        lyric = joint.join(phonemes).replace('pau', 'R')
+        if lyric.endswith('cl') and lyric != 'cl':
+            lyric = lyric.replace('cl', ' cl')
+        ust_note.lyric = lyric
+        yield ust_note
+
+
+def _iter_htsnote_contexts(contexts):
+    """
+    utaupy.hts.iter_contexts で読み取った行を、ノートごとの (e, 音素記号のリスト) にまとめる。
+    ノートの区切り方は HTSFullLabel.generate_songobj と同じで、
+    休符の行か「ノート内で最初の音節」の「音節内で最初の音素」の行から新しいノートにする。
+    """
+    rest_classes = up.hts.REST_CLASSES
+    e = None
+    phonemes = []
+    for _, _, l_contexts in contexts:
+        p = l_contexts[0]
+        if p[0] in rest_classes or (l_contexts[2][1] == '1' and p[11] == '1'):
+            if e is not None:
+                yield e, phonemes
+            e = l_contexts[5]
+            phonemes = []
+        phonemes.append(p[3])
+    if e is not None:
+        yield e, phonemes
+
+
+def iter_ustnotes(source, joint: str = ' ', encoding='utf-8'):
+    """
+    HTSフルコンテキストラベルのファイルまたは行のリストを先頭から順に読み取り、
+    utaupy.ust.Note を1ノートずつ生成するジェネレータ。
+    ファイル全体を Song オブジェクトにしないので、長いファイルにも使える。
+    """
+    notes = _iter_htsnote_contexts(up.hts.iter_contexts(source, encoding=encoding))
+    # (e1, e4, e5, e8, 音素記号のリスト)
+    rows = ((e[0], e[3], e[4], e[7], phonemes) for e, phonemes in notes)
+    return _rows2ustnotes(rows, joint)
+
+
 def clean_beat(ust):
     """
     不要な拍子情報を削除する
@@ -51,25 +136,54 @@ def songobj2ustobj(hts_song: up.hts.Song, d_table: dict = None, joint: str = ' '
     joint: 音素記号を結合するときにはさむ文字
     """
     ust = up.ust.Ust()
-    # 各ノートを変換する
-    for hts_note in hts_song:
-        ust_note = htsnote2ustnote(hts_note, d_table, joint=joint)
-        ust.notes.append(ust_note)
-    # 重複するテンポ情報を削除
+    # 各ノートを変換する。テンポと拍子情報は変化するところだけ登録される。
+    ust.notes = list(
+        htscolumns2ustnotes(
+            (hts_note.absolute_pitch for hts_note in hts_song),
+            (hts_note.tempo for hts_note in hts_song),
+            (hts_note.length for hts_note in hts_song),
+            ([phoneme.identity for phoneme in hts_note.phonemes] for hts_note in hts_song),
+            beats=(hts_note.beat for hts_note in hts_song),
+            joint=joint,
+        )
+    )
+    # グローバルテンポを設定する
     ust.reload_tempo()
-    # 重複する拍子情報を削除
-    clean_beat(ust)
     return ust
 
 
+def write_ustnotes(path_ust, ust_notes, mode='w', encoding='cp932') -> int:
+    """
+    ust.Note のイテラブルを先頭から順にUSTファイルに書き込む。
+    Ust.write と同じ形式で出力するが、ノート全体をメモリ上に保持しない。
+    1ノート目のテンポをグローバルテンポにする。書き込んだノート数を返す。
+    """
+    ust = up.ust.Ust()
+    n = 0
+    with open(path_ust, mode=mode, encoding=encoding) as f:
+        for n, ust_note in enumerate(ust_notes, 1):
+            # 1ノート目のテンポはグローバルテンポとして [#SETTING] に書く
+            if n == 1:
+                if 'Tempo' in ust_note:
+                    ust.setting['Tempo'] = ust_note['Tempo']
+                    del ust_note['Tempo']
+                f.write(f'{ust.setting}\n')
+            ust_note.tag = f'[#{str(n - 1).zfill(4)}]'
+            f.write(f'{ust_note}\n')
+        if n == 0:
+            f.write(f'{ust.setting}\n\n')
+        f.write(f'{ust.trackend}\n')
+    return n
+
+
 def hts2ust(path_hts, path_ust, path_table=None, joint: str = ' '):
     """
     HTSフルコンテキストラベルファイルをUSTファイルに変換する。
+    ラベルを先頭から1ノートずつ変換して書き込む。
+
+    path_table: 互換性のために残している。音素記号から歌詞への変換には使わない。
     """
-    d_table = up.table.load(path_table) if path_table is not None else None
-    full_label = up.hts.load(path_hts)
-    ust = songobj2ustobj(full_label.song, d_table, joint=joint)
-    ust.write(path_ust)
+    write_ustnotes(path_ust, iter_ustnotes(path_hts, joint=joint))
 
 
 def main():
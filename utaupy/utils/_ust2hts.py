@@ -3,7 +3,8 @@
 # Copyright (c) 2020 oatsu
 """
 USTファイルをHTSフルラベルに変換する。
-Songオブジェクトを使って生成する。
+Songオブジェクトを使って生成する方法 (ustobj2songobj) と、
+Songオブジェクトを経由せずにラベルの各行を直接生成する方法 (ustobj2htslines) がある。
 いまのところ日本語にしか対応していないので注意。
 
 対象
@@ -23,7 +24,8 @@ d2, d3, e2, e3, f2, f3 はスケール判定が必要なため、実行時にキ
 d3, e3, f3 には 'xx' を代入する。歌うときに休符の学習データ引っ張ってきそうな気はする。
 """
 
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import chain
 
 import utaupy as up
 
@@ -33,6 +35,7 @@ def ustnote2htsnote(
 ) -> up.hts.Note:
     """
     utaupy.ust.Note を utaupy.hts.Note に変換する。
+    d_table には utaupy.table.LyricConverter や utaupy.table.CompiledTable も指定できる。
     """
     # ノート全体の情報を登録
     hts_note = up.hts.Note()
@@ -56,15 +59,11 @@ def ustnote2htsnote(
     # e8
     hts_note.length = round(ust_note.length / 20)
 
-    # UST内のノートの歌詞を空白で区切る
-    kana_lyrics = ust_note.lyric.replace('っ', ' っ ').split()
-
     # TODO: 音節数を2以上にできるようにする
     hts_syllable = up.hts.Syllable()
     # かな→ローマ字 で音素変換する
-    phonemes = []
-    for lyric in kana_lyrics:
-        phonemes += d_table.get(lyric, [lyric])
+    # 「きゃっと」のような複数文字の歌詞は、テーブルの見出しと最長一致する部分ずつ変換する
+    phonemes = up.table.as_converter(d_table).convert(ust_note.lyric)
     # 音素を追加していく
     for phoneme in phonemes:
         hts_phoneme = up.hts.Phoneme()
@@ -95,6 +94,8 @@ def ustobj2songobj(ust: up.ust.Ust, d_table: dict, key_of_the_note: int = None)
     """
     song = up.hts.Song()
     ust_notes = ust.notes
+    # 変換テーブルはノートごとに作りなおさない
+    d_table = up.table.as_converter(d_table)
     # Noteオブジェクトの種類を変換
     for ust_note in ust_notes:
         hts_note = ustnote2htsnote(ust_note, d_table, key_of_the_note=key_of_the_note)
@@ -107,6 +108,279 @@ def ustobj2songobj(ust: up.ust.Ust, d_table: dict, key_of_the_note: int = None)
     return song
 
 
+def _vowel_distances(p1_list: list) -> list:
+    """
+    音節内の各音素について、直前の母音からの距離 (p14) を求める。
+    逆順のリストを渡すと直後の母音までの距離 (p15) になる。
+    Song._fill_p14_p15 と同じ処理。
+    """
+    distances = ['xx'] * len(p1_list)
+    distance = None
+    for i, p1 in enumerate(p1_list):
+        if p1 == 'v':
+            distance = 1
+        elif distance is None:
+            continue
+        elif p1 == 'c':
+            distances[i] = distance
+            distance += 1
+        # 母音でも子音でもない場合(clとか)
+        else:
+            distance += 1
+    return distances
+
+
+def ustobj2htslines(
+    ust: up.ust.Ust,
+    d_table: dict,
+    key_of_the_note: int = None,
+    strict_sinsy_style: bool = True,
+    as_mono: bool = False,
+    hts_conf=None,
+) -> list:
+    """
+    Ustオブジェクトから、Songオブジェクトを経由せずにラベルの各行の文字列を生成する。
+    ustobj2songobj で作った Song の write と同じ文字列になる。
+    ノートごとのコンテキストはリストで計算し、各行はノート単位の文字列をつなげて作る。
+    日本語歌詞を想定するため、音節数は1とする。
+
+    hts_conf: 音素分類用の辞書、utaupy.table.CompiledTable または utaupy.hts.PhonemeClassifier
+    """
+    hts = up.hts
+    zero = Decimal('0')
+    converter = up.table.as_converter(d_table)
+    classify_many = hts.PhonemeClassifier.from_conf(hts_conf).classify_many
+    ust_notes = ust.notes
+    num_notes = len(ust_notes)
+
+    # ノートごとの音素記号とp1
+    identities = [converter.convert(ust_note.lyric) for ust_note in ust_notes]
+    p1_lists = [classify_many(phonemes) for phonemes in identities]
+    # e5, e8 と 100ns単位のノート長
+    tempos = [Decimal(ust_note.tempo) for ust_note in ust_notes]
+    lengths = [round(ust_note.length / 20) for ust_note in ust_notes]
+    lengths_100ns = [
+        Decimal(25000000 * int(length) / Decimal(tempo)) for length, tempo in zip(lengths, tempos)
+    ]
+
+    # 発声開始時刻と終了時刻 (Song.reset_time と同じ計算)
+    starts = []
+    ends = []
+    t_start = 0
+    t_end = 0
+    for length_100ns in lengths_100ns:
+        t_end += length_100ns
+        starts.append(int(Decimal(t_start).quantize(zero, rounding=ROUND_HALF_UP)))
+        ends.append(int(Decimal(t_end).quantize(zero, rounding=ROUND_HALF_UP)))
+        t_start = t_end
+
+    if as_mono:
+        return [
+            f'{start} {end} {phoneme}'
+            for start, end, phonemes in zip(starts, ends, identities)
+            for phoneme in phonemes
+        ]
+
+    rest_classes = hts.REST_CLASSES
+    is_rest = [p1_list[0] in rest_classes for p1_list in p1_lists]
+    is_break = [len(p1_list) == 1 and p1_list[0] == 'b' for p1_list in p1_lists]
+
+    # 音節のコンテキスト (b1-b3)
+    b = [[len(phonemes), 1, 1, 'xx', 'xx'] for phonemes in identities]
+    # ノートのコンテキスト (e1-e60)
+    e = [['xx'] * 60 for _ in range(num_notes)]
+    for e_note, ust_note, tempo, length, length_100ns in zip(
+        e, ust_notes, tempos, lengths, lengths_100ns
+    ):
+        notenum = ust_note.notenum
+        e_note[0] = hts.notenum_to_abspitch(notenum)
+        if key_of_the_note is not None:
+            e_note[1] = (notenum - key_of_the_note) % 12
+            e_note[2] = key_of_the_note
+        e_note[4] = tempo
+        e_note[5] = 1
+        e_note[6] = Decimal(length_100ns / 100000).quantize(zero, rounding=ROUND_HALF_UP)
+        e_note[7] = length
+
+    # e18, e19: 休符からの距離
+    positions = []
+    counter = 0
+    for rest in is_rest:
+        counter = 0 if rest else counter + 1
+        positions.append('xx' if rest else counter)
+    positions_backward = []
+    counter = 0
+    for rest in reversed(is_rest):
+        counter = 0 if rest else counter + 1
+        positions_backward.append('xx' if rest else counter)
+    positions_backward.reverse()
+
+    # e20, e22: 前の休符からの時間
+    counter_100ns = 0
+    counter = 0
+    for e_note, position, length, length_100ns in zip(e, positions, lengths, lengths_100ns):
+        e_note[17] = position
+        if position == 'xx':
+            counter_100ns = 0
+            counter = 0
+        elif position == 1:
+            e_note[19] = 0
+            e_note[21] = 0
+            counter_100ns += length_100ns
+            counter += int(length)
+        else:
+            e_note[19] = Decimal(counter_100ns / 1000000).quantize(zero, rounding=ROUND_HALF_UP)
+            e_note[21] = counter
+            counter_100ns += length_100ns
+            counter += int(length)
+
+    # e21, e23: 次の休符までの時間
+    positions_100ns_backward = [None] * num_notes
+    counter_100ns = 0
+    counter = 0
+    for i in reversed(range(num_notes)):
+        e_note = e[i]
+        position_backward = positions_backward[i]
+        e_note[18] = position_backward
+        if position_backward == 'xx':
+            counter_100ns = 0
+            counter = 0
+            continue
+        if position_backward == 1:
+            counter_100ns = lengths_100ns[i]
+            counter = int(lengths[i])
+        else:
+            counter_100ns += lengths_100ns[i]
+            counter += int(lengths[i])
+        e_note[20] = Decimal(counter_100ns / 1000000).quantize(zero, rounding=ROUND_HALF_UP)
+        e_note[22] = counter
+        positions_100ns_backward[i] = counter_100ns
+
+    # e24, e25: フレーズ内での位置(パーセント)
+    phrase_length_100ns = 0
+    counter_100ns = 0
+    for e_note, position, rest, length_100ns, position_100ns_backward in zip(
+        e, positions, is_rest, lengths_100ns, positions_100ns_backward
+    ):
+        if position == 'xx' or rest:
+            phrase_length_100ns = 0
+            counter_100ns = 0
+            continue
+        if position == 1:
+            phrase_length_100ns = position_100ns_backward
+        e_note[23] = Decimal(100 * counter_100ns / phrase_length_100ns).quantize(
+            zero, rounding=ROUND_HALF_UP
+        )
+        e_note[24] = 100 - e_note[23]
+        counter_100ns += length_100ns
+
+    # e57, e58: 前後のノートとの音高差
+    notenums = [hts.abspitch_to_notenum(e_note[0]) for e_note in e]
+    is_rest_or_break = [rest or brk for rest, brk in zip(is_rest, is_break)]
+    for i in range(1, num_notes):
+        if is_rest_or_break[i - 1] or is_rest_or_break[i]:
+            continue
+        pitch_difference = notenums[i - 1] - notenums[i]
+        e[i][56] = f'{"p" if pitch_difference >= 0 else "m"}{abs(pitch_difference)}'
+        pitch_difference = notenums[i] - notenums[i - 1]
+        e[i - 1][57] = f'{"p" if pitch_difference >= 0 else "m"}{abs(pitch_difference)}'
+
+    # j3: 休符→音符 の並びの回数
+    number_of_phrases = 0 if is_rest[0] else 1
+    for previous_rest, rest in zip(is_rest, is_rest[1:]):
+        if previous_rest and not rest:
+            number_of_phrases += 1
+
+    # adjust_break_contexts と同じ処理。前後のノートの d, f にも反映される。
+    for e_note, brk in zip(e, is_break):
+        if brk:
+            e_note[0:3] = ['xx'] * 3
+    # adjust_pau_contexts(strict=False) と同じ処理。前後の a, c, d, f にも反映される。
+    if not strict_sinsy_style:
+        for b_note, e_note, rest in zip(b, e, is_rest):
+            if rest:
+                b_note[0:3] = ['xx'] * 3
+                e_note[0:3] = ['xx'] * 3
+
+    # ノート単位の文字列 (/A: から /J: まで) をつくる
+    dummy_syllable = ['xx'] * 5
+    dummy_note = ['xx'] * 60
+    str_phrase_and_song = ''.join(
+        (
+            hts.FORMAT_G.format('xx', 'xx'),
+            hts.FORMAT_H.format('xx', 'xx'),
+            hts.FORMAT_I.format('xx', 'xx'),
+            hts.FORMAT_J.format('xx', 'xx', number_of_phrases),
+        )
+    )
+    str_notes = []
+    for i in range(num_notes):
+        a = b[i - 1] if i > 0 else dummy_syllable
+        c = b[i + 1] if i < num_notes - 1 else dummy_syllable
+        d = e[i - 1] if i > 0 else dummy_note
+        f = e[i + 1] if i < num_notes - 1 else dummy_note
+        e_note = e[i]
+        # adjust_pau_contexts(strict=True) と同じ処理。その行だけに反映される。
+        if strict_sinsy_style:
+            if i > 0:
+                if identities[i - 1][0] in ('pau', 'sil'):
+                    a = ['xx'] * 3 + a[3:]
+                if is_rest[i - 1]:
+                    d = ['xx'] * 8 + d[8:]
+            if is_rest[i]:
+                e_note = ['xx'] * 2 + e_note[2:]
+            if i < num_notes - 1:
+                if identities[i + 1][0] in ('pau', 'sil'):
+                    c = ['xx'] * 3 + c[3:]
+                if is_rest[i + 1]:
+                    f = ['xx'] * 8 + f[8:]
+        str_notes.append(
+            ''.join(
+                (
+                    hts.FORMAT_A.format(*a),
+                    hts.FORMAT_B.format(*b[i]),
+                    hts.FORMAT_C.format(*c),
+                    hts.FORMAT_D.format(*d),
+                    hts.FORMAT_E.format(*e_note),
+                    hts.FORMAT_F.format(*f),
+                    str_phrase_and_song,
+                )
+            )
+        )
+
+    # 音素ごとの行をつくる。前後2音素ぶんは 'xx' で埋める。
+    padding = ['xx', 'xx']
+    all_identities = padding + list(chain.from_iterable(identities)) + padding
+    all_flags = padding[:]
+    for ust_note, phonemes in zip(ust_notes, identities):
+        # ustのローカルフラグが設定されている時だけp9に記入
+        flag = ust_note.flags
+        all_flags += [flag if flag != '' else 'xx'] * len(phonemes)
+    all_flags += padding
+
+    format_p = hts.FORMAT_P.format
+    lines = []
+    k = 0
+    for start, end, str_note, p1_list in zip(starts, ends, str_notes, p1_lists):
+        len_syllable = len(p1_list)
+        distances_from_previous_vowel = _vowel_distances(p1_list)
+        distances_to_next_vowel = _vowel_distances(p1_list[::-1])[::-1]
+        for j, p1 in enumerate(p1_list):
+            str_p = format_p(
+                p1,
+                *all_identities[k : k + 5],
+                *all_flags[k : k + 5],
+                j + 1,
+                len_syllable - j,
+                distances_from_previous_vowel[j],
+                distances_to_next_vowel[j],
+                'xx',
+            )
+            lines.append(f'{start} {end} {str_p}{str_note}')
+            k += 1
+    return lines
+
+
 def ust2hts(
     path_ust: str,
     path_hts: str,
@@ -118,12 +392,13 @@ def ust2hts(
     USTファイルをLABファイルに変換する。
     """
     ust = up.ust.load(path_ust)
-    d_table = up.table.load(path_table, encoding='utf-8')
-    # Ust → HTSFullLabel
-    hts_song = ustobj2songobj(ust, d_table)
-    # HTSFullLabel中の重複データを削除して整理
+    # 解析済みのテーブルを使い回す
+    d_table = up.table.load_compiled(path_table, encoding='utf-8')
+    # Songオブジェクトを経由せずにラベルの各行をつくる
+    lines = ustobj2htslines(ust, d_table, strict_sinsy_style=strict_sinsy_style, as_mono=as_mono)
     # ファイル出力
-    hts_song.write(path_hts, strict_sinsy_style=strict_sinsy_style, as_mono=as_mono)
+    with open(path_hts, mode='w', encoding='utf-8', newline='\n') as f:
+        f.write('\n'.join(lines))
 
 
 # def __ust2hts_with_precise_time(